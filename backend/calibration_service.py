@@ -1,5 +1,8 @@
+import asyncio
 import os
 import re
+import selectors
+import stat
 from pathlib import Path
 from typing import Dict, Any, Optional
 import logging
@@ -8,6 +11,7 @@ import queue
 import subprocess
 from datetime import datetime
 import sys
+import time
 
 # Import the function to get HF environment variables
 from backend.env_manager import get_hf_env_for_cli
@@ -15,6 +19,12 @@ from backend.env_manager import get_hf_env_for_cli
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Device names listed as candidate robot ports: ttyUSB*, ttyACM* and macOS tty.*
+_USB_PORT_NAME = re.compile(r'(ttyUSB|ttyACM|tty\.)')
+
+# Seconds a port scan stays valid for repeated /list-ports calls
+PORTS_CACHE_TTL = 2.0
+
 def clean_ansi_codes(text: str) -> str:
     """
     Remove ANSI escape codes from text
@@ -37,6 +47,22 @@ def clean_ansi_codes(text: str) -> str:
     
     return cleaned
 
+def _scan_usb_ports() -> list[str]:
+    """
+    Scan /dev for USB serial ports
+    """
+    # Common USB port patterns, grouped in the order they are reported
+    found = {"ttyUSB": [], "ttyACM": [], "tty.": []}
+    
+    # One pass over /dev instead of a separate glob (and directory scan) per pattern
+    if os.path.isdir("/dev"):
+        with os.scandir("/dev") as entries:
+            for entry in entries:
+                match = _USB_PORT_NAME.match(entry.name)
+                if match:
+                    found[match.group(1)].append(entry.path)
+    return [port for group in found.values() for port in group]
+
 class CalibrationService:
     def __init__(self):
         self.active_sessions = {}   # session_id -> session_data
@@ -44,6 +70,10 @@ class CalibrationService:
         self.active_processes = {}  # session_id -> (process, master_fd)
         self._calibration_phases = {}  # session_id -> current_phase
         self.cancelled_sessions = set()  # Track cancelled sessions
+        self._output_events = {}    # session_id -> (loop, asyncio.Event) set when output is queued
+        self._ports_cache = None    # Last list_ports() result
+        self._ports_cache_time = 0.0
+        self._ports_lock = asyncio.Lock()
     
     async def start_calibration(self, arm_type: str, robot_type: str, port: str, robot_id: str) -> str:
         """
@@ -62,6 +92,7 @@ class CalibrationService:
             
             # Create output queue for this session
             self.output_queues[session_id] = queue.Queue()
+            self._output_events[session_id] = (asyncio.get_running_loop(), asyncio.Event())
             
             # Store session info
             self.active_sessions[session_id] = {
@@ -149,7 +180,6 @@ class CalibrationService:
             process, master_fd = self.active_processes[session_id]
             self.active_sessions[session_id]["status"] = "running"
             logger.info(f"Starting to monitor calibration (PTY) for {session_id}")
-            import select
             import time
             import os
             last_output_time = time.time()
@@ -163,93 +193,103 @@ class CalibrationService:
                 self._calibration_phases = {}
             self._calibration_phases[session_id] = "initial"  # initial, first_step, second_step, waiting
             
-            while True:
-                # Check if process is still running
-                if process.poll() is not None:
-                    logger.info(f"Process finished for {session_id}")
-                    break
+            with selectors.DefaultSelector() as selector:
+                selector.register(master_fd, selectors.EVENT_READ)
+                while True:
+                    # Check if process is still running
+                    if process.poll() is not None:
+                        logger.info(f"Process finished for {session_id}")
+                        break
                 
-                # Try to read output without blocking
-                ready, _, _ = select.select([master_fd], [], [], 0.05)  # Reduced timeout
-                if ready:
-                    try:
-                        # Read all available data
-                        data = os.read(master_fd, 4096)  # Read up to 4KB
-                        if data:
-                            # Decode the data
-                            text_data = data.decode('utf-8', errors='ignore')
-                            # Split into lines and process each
-                            lines = text_data.split('\n')
-                            for line in lines:
-                                line = line.strip()
-                                if line:
-                                    # Clean ANSI escape codes
-                                    line = clean_ansi_codes(line)
-                                    logger.info(f"PTY Output from {session_id}: {line}")
+                    # Try to read output without blocking
+                    ready = selector.select(0.05)  # Blocks in the kernel; no extra sleep needed
+                    if ready:
+                        try:
+                            # Read all available data
+                            # Take everything buffered in one read rather than 4 KB per wakeup
+                            data = os.read(master_fd, 65536)
+                            if data:
+                                # Decode the data
+                                text_data = data.decode('utf-8', errors='ignore')
+                                # Split into lines and process each
+                                lines = text_data.split('\n')
+                                for line in lines:
+                                    line = line.strip()
+                                    if line:
+                                        # Clean ANSI escape codes
+                                        line = clean_ansi_codes(line)
+                                        logger.info(f"PTY Output from {session_id}: {line}")
                                     
-                                    # Check if this is a traceback or error
-                                    if "traceback" in line.lower() or "error" in line.lower() or "exception" in line.lower():
-                                        logger.warning(f"Detected error/traceback in {session_id}: {line}")
-                                        self._add_output(session_id, f"ERROR: {line}")
-                                    else:
-                                        self._add_output(session_id, line)
+                                        # Check if this is a traceback or error
+                                        if "traceback" in line.lower() or "error" in line.lower() or "exception" in line.lower():
+                                            logger.warning(f"Detected error/traceback in {session_id}: {line}")
+                                            self._add_output(session_id, f"ERROR: {line}")
+                                        else:
+                                            self._add_output(session_id, line)
                                     
-                                    # State machine for calibration phases
-                                    line_lower = line.lower()
-                                    current_phase = self._calibration_phases.get(session_id, "initial")
+                                        # State machine for calibration phases
+                                        line_lower = line.lower()
+                                        current_phase = self._calibration_phases.get(session_id, "initial")
                                     
-                                    if current_phase == "initial":
-                                        # Look for first step instructions
-                                        if "move test" in line_lower and "middle of its range" in line_lower:
-                                            logger.info(f"Transitioning to first_step phase for {session_id}")
-                                            self._calibration_phases[session_id] = "first_step"
-                                            # Don't set waiting yet - let user see first step
+                                        if current_phase == "initial":
+                                            # Look for first step instructions
+                                            if "move test" in line_lower and "middle of its range" in line_lower:
+                                                logger.info(f"Transitioning to first_step phase for {session_id}")
+                                                self._calibration_phases[session_id] = "first_step"
+                                                # Don't set waiting yet - let user see first step
                                     
-                                    elif current_phase == "first_step":
-                                        # Look for second step instructions
-                                        if "move all joints" in line_lower and "entire ranges" in line_lower:
-                                            logger.info(f"Transitioning to second_step phase for {session_id}")
-                                            self._calibration_phases[session_id] = "second_step"
-                                            # Now set waiting for input - this is when the process actually waits
-                                            self.active_sessions[session_id]["waiting_for_input"] = True
-                                            logger.info(f"Set waiting_for_input=True for {session_id} after seeing second step")
+                                        elif current_phase == "first_step":
+                                            # Look for second step instructions
+                                            if "move all joints" in line_lower and "entire ranges" in line_lower:
+                                                logger.info(f"Transitioning to second_step phase for {session_id}")
+                                                self._calibration_phases[session_id] = "second_step"
+                                                # Now set waiting for input - this is when the process actually waits
+                                                self.active_sessions[session_id]["waiting_for_input"] = True
+                                                logger.info(f"Set waiting_for_input=True for {session_id} after seeing second step")
                                     
-                                    # Also detect explicit "press enter" prompts in any phase
-                                    if any(phrase in line_lower for phrase in [
-                                        "press enter....", "press enter to stop", "press enter to continue"
-                                    ]):
-                                        logger.info(f"Detected explicit waiting for input in {session_id}: '{line}'")
-                                        self.active_sessions[session_id]["waiting_for_input"] = True
-                                        self._calibration_phases[session_id] = "waiting"
+                                        # Also detect explicit "press enter" prompts in any phase
+                                        if any(phrase in line_lower for phrase in [
+                                            "press enter....", "press enter to stop", "press enter to continue"
+                                        ]):
+                                            logger.info(f"Detected explicit waiting for input in {session_id}: '{line}'")
+                                            self.active_sessions[session_id]["waiting_for_input"] = True
+                                            self._calibration_phases[session_id] = "waiting"
                             
-                            last_output_time = time.time()
-                            waiting_detected = False
-                            no_output_count = 0
+                                last_output_time = time.time()
+                                waiting_detected = False
+                                no_output_count = 0
+                            else:
+                                # EOF: the exit code comes from wait() below
+                                selector.unregister(master_fd)
+                                break
                                 
-                    except Exception as e:
-                        logger.error(f"PTY read error for {session_id}: {e}")
-                else:
-                    # No output available, check if we should assume waiting for input
-                    current_time = time.time()
-                    no_output_count += 1
+                        except OSError:
+                            # EIO once the slave side hangs up; stop reading rather than spin
+                            selector.unregister(master_fd)
+                            break
+                        except Exception as e:
+                            logger.error(f"PTY read error for {session_id}: {e}")
+                    else:
+                        # No output available, check if we should assume waiting for input
+                        current_time = time.time()
+                        no_output_count += 1
                     
-                    # If no output for initial_wait_time seconds, assume waiting for input
-                    if not waiting_detected and (current_time - last_output_time) > initial_wait_time:
-                        logger.info(f"Detected waiting for input in {session_id} (no output for {initial_wait_time}+ seconds)")
-                        self.active_sessions[session_id]["waiting_for_input"] = True
-                        waiting_detected = True
-                        # Add a message to indicate we're waiting for input
-                        self._add_output(session_id, "Waiting for user input...")
+                        # If no output for initial_wait_time seconds, assume waiting for input
+                        if not waiting_detected and (current_time - last_output_time) > initial_wait_time:
+                            logger.info(f"Detected waiting for input in {session_id} (no output for {initial_wait_time}+ seconds)")
+                            self.active_sessions[session_id]["waiting_for_input"] = True
+                            waiting_detected = True
+                            # Add a message to indicate we're waiting for input
+                            self._add_output(session_id, "Waiting for user input...")
                     
-                    # If still no output after 3 seconds, add a status message
-                    elif waiting_detected and no_output_count % 60 == 0:  # Every 3 seconds (60 * 0.05)
-                        logger.info(f"Still waiting for output from {session_id} (no output for {current_time - last_output_time:.1f} seconds)")
-                        self._add_output(session_id, "Still waiting for calibration process...")
-                
-                time.sleep(0.05)  # Reduced sleep time
+                        # If still no output after 3 seconds, add a status message
+                        elif waiting_detected and no_output_count % 120 == 0:  # Every ~6 seconds (120 * 0.05)
+                            logger.info(f"Still waiting for output from {session_id} (no output for {current_time - last_output_time:.1f} seconds)")
+                            self._add_output(session_id, "Still waiting for calibration process...")
             
             # Process has finished
-            if process.poll() == 0:
+            exit_code = process.wait()
+            if exit_code == 0:
                 # Check if session was cancelled by user
                 if session_id in self.cancelled_sessions:
                     self._add_output(session_id, "Calibration cancelled by user")
@@ -268,8 +308,8 @@ class CalibrationService:
                 else:
                     if session_id in self.active_sessions:
                         self.active_sessions[session_id]["status"] = "failed"
-                    self._add_output(session_id, f"Calibration failed with exit code {process.poll()}")
-                    logger.error(f"Calibration failed for {session_id} with exit code {process.poll()}")
+                    self._add_output(session_id, f"Calibration failed with exit code {exit_code}")
+                    logger.error(f"Calibration failed for {session_id} with exit code {exit_code}")
                 
         except Exception as e:
             error_msg = f"Calibration monitoring error: {str(e)}"
@@ -282,6 +322,10 @@ class CalibrationService:
                 self.active_sessions[session_id]["error"] = str(e)
             else:
                 logger.warning(f"Session {session_id} was already cleaned up, skipping status update")
+        finally:
+            # The final status is set by now; wake the WebSocket so it sees the exit
+            # immediately instead of on its next wait_for_output timeout
+            self._notify_output(session_id)
     
     def _add_output(self, session_id: str, message: str):
         """
@@ -294,6 +338,7 @@ class CalibrationService:
                 "message": message
             }
             self.output_queues[session_id].put(output_data)
+            self._notify_output(session_id)
             
             # Check if session still exists before updating it
             if session_id in self.active_sessions:
@@ -305,6 +350,35 @@ class CalibrationService:
         else:
             logger.error(f"No output queue found for {session_id}")
     
+    def _notify_output(self, session_id: str):
+        """
+        Wake any consumer waiting on this session; safe to call from the monitor thread
+        """
+        waiter = self._output_events.get(session_id)
+        if waiter is None:
+            return
+        loop, event = waiter
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # The loop has shut down, so nobody is left to wake
+            pass
+    
+    async def wait_for_output(self, session_id: str, timeout: float = 0.5):
+        """
+        Wait until new output is queued for a session, or until the timeout passes
+        """
+        waiter = self._output_events.get(session_id)
+        if waiter is None:
+            return
+        _, event = waiter
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        # Cleared before the caller drains, so output queued after this point wakes the next wait
+        event.clear()
+    
     async def send_input(self, session_id: str, input_data: str = "\n") -> bool:
         """
         Send input to an active calibration process
@@ -447,6 +521,10 @@ class CalibrationService:
                 del self.active_sessions[session_id]
             if hasattr(self, '_calibration_phases') and session_id in self._calibration_phases:
                 del self._calibration_phases[session_id]
+            waiter = self._output_events.pop(session_id, None)
+            if waiter is not None:
+                # Let a waiting WebSocket notice the session is gone right away
+                waiter[1].set()
             
             logger.info(f"Stopped calibration process for {session_id}")
             return True
@@ -467,6 +545,7 @@ class CalibrationService:
         
         try:
             files = []
+            seen_paths = set()
             
             if cache_dir.exists():
                 # Recursively search through subdirectories
@@ -477,13 +556,24 @@ class CalibrationService:
                 for pattern in patterns:
                     # Search recursively through all subdirectories
                     for file in cache_dir.rglob(pattern):
-                        if file.is_file() and file not in [f["path"] for f in files]:
-                            files.append({
-                                "name": file.name,
-                                "path": str(file),
-                                "size": file.stat().st_size,
-                                "modified": file.stat().st_mtime
-                            })
+                        path = str(file)
+                        if path in seen_paths:
+                            continue
+                        # One stat per match covers the file check, size and mtime
+                        try:
+                            file_stat = file.stat()
+                        except OSError:
+                            # Broken symlink or a file removed mid-scan; skip it like is_file() did
+                            continue
+                        if not stat.S_ISREG(file_stat.st_mode):
+                            continue
+                        seen_paths.add(path)
+                        files.append({
+                            "name": file.name,
+                            "path": path,
+                            "size": file_stat.st_size,
+                            "modified": file_stat.st_mtime
+                        })
             else:
                 logger.warning(f"Cache directory does not exist: {cache_dir}")
             
@@ -506,29 +596,34 @@ class CalibrationService:
                 "error": str(e)
             }
     
-    async def list_ports(self) -> Dict[str, Any]:
+    async def list_ports(self, refresh: bool = False) -> Dict[str, Any]:
         """
-        List available USB ports
+        List available USB ports, reusing a scan younger than PORTS_CACHE_TTL unless refresh is set
         """
+        requested_at = time.monotonic()
+        if not refresh and self._ports_cache is not None and requested_at - self._ports_cache_time < PORTS_CACHE_TTL:
+            return self._ports_cache
         try:
-            ports = []
-            
-            # Check common USB port patterns
-            common_patterns = [
-                "/dev/ttyUSB*",
-                "/dev/ttyACM*", 
-                "/dev/tty.*",
-            ]
-            
-            for pattern in common_patterns:
-                import glob
-                found_ports = glob.glob(pattern)
-                ports.extend(found_ports)
-            
-            return {
-                "ports": ports,
-                "count": len(ports)
-            }
+            # Concurrent callers wait for the scan in progress instead of starting their own
+            async with self._ports_lock:
+                # The scan we waited on may already satisfy this call: any recent one for a
+                # plain listing, one started after this call was made for a refresh
+                if self._ports_cache is not None:
+                    if self._ports_cache_time >= requested_at:
+                        return self._ports_cache
+                    if not refresh and time.monotonic() - self._ports_cache_time < PORTS_CACHE_TTL:
+                        return self._ports_cache
+                
+                scan_started = time.monotonic()
+                # Directory listing is blocking I/O; keep it off the event loop
+                ports = await asyncio.to_thread(_scan_usb_ports)
+                
+                self._ports_cache = {
+                    "ports": ports,
+                    "count": len(ports)
+                }
+                self._ports_cache_time = scan_started
+                return self._ports_cache
             
         except Exception as e:
             logger.error(f"Failed to list ports: {e}")
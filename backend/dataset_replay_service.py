@@ -5,7 +5,7 @@ from datetime import datetime
 import logging
 import os
 import pty
-import select
+import selectors
 import time
 import json
 import re
@@ -118,30 +118,35 @@ class DatasetReplayService:
             self.active_sessions[session_id]["status"] = "running"
             logger.info(f"Starting to monitor dataset replay (PTY) for {session_id}")
             
-            while True:
-                if process.poll() is not None:
-                    logger.info(f"Process finished for {session_id}")
-                    break
-                ready, _, _ = select.select([master_fd], [], [], 0.05)
-                if ready:
-                    try:
-                        data = os.read(master_fd, 4096)
-                        if data:
-                            text_data = data.decode('utf-8', errors='ignore')
-                            lines = text_data.split('\n')
-                            for line in lines:
-                                line = line.strip()
-                                if line:
-                                    # Clean ANSI codes and add to output
-                                    cleaned_line = self._clean_ansi_codes(line)
-                                    if cleaned_line:
-                                        self._add_output(session_id, cleaned_line)
-                    except Exception as e:
-                        logger.error(f"PTY read error for {session_id}: {e}")
-                time.sleep(0.05)
+            with selectors.DefaultSelector() as selector:
+                selector.register(master_fd, selectors.EVENT_READ)
+                while True:
+                    if process.poll() is not None:
+                        logger.info(f"Process finished for {session_id}")
+                        break
+                    ready = selector.select(0.05)
+                    if ready:
+                        try:
+                            data = os.read(master_fd, 65536)
+                        except OSError:
+                            data = b''
+                        if not data:
+                            # The slave side hung up; the exit code comes from wait() below
+                            selector.unregister(master_fd)
+                            break
+                        text_data = data.decode('utf-8', errors='ignore')
+                        lines = text_data.split('\n')
+                        for line in lines:
+                            line = line.strip()
+                            if line:
+                                # Clean ANSI codes and add to output
+                                cleaned_line = self._clean_ansi_codes(line)
+                                if cleaned_line:
+                                    self._add_output(session_id, cleaned_line)
             
             # Process has finished
-            if process.poll() == 0:
+            exit_code = process.wait()
+            if exit_code == 0:
                 if session_id in self.cancelled_sessions:
                     self._add_output(session_id, "Dataset replay cancelled by user")
                     logger.info(f"Dataset replay cancelled by user for {session_id}")
@@ -157,8 +162,8 @@ class DatasetReplayService:
                 else:
                     if session_id in self.active_sessions:
                         self.active_sessions[session_id]["status"] = "failed"
-                    self._add_output(session_id, f"Dataset replay failed with exit code {process.poll()}")
-                    logger.error(f"Dataset replay failed for {session_id} with exit code {process.poll()}")
+                    self._add_output(session_id, f"Dataset replay failed with exit code {exit_code}")
+                    logger.error(f"Dataset replay failed for {session_id} with exit code {exit_code}")
         except Exception as e:
             error_msg = f"Dataset replay monitoring error: {str(e)}"
             logger.error(f"Dataset replay error for {session_id}: {e}")
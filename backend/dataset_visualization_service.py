@@ -1,3 +1,4 @@
+import asyncio
 import requests
 import logging
 from typing import List, Dict, Optional
@@ -20,7 +21,8 @@ class DatasetVisualizationService:
             
             # Fetch datasets from the user's profile
             url = f"{self.base_url}/datasets?author={username}&sort=downloads&direction=-1"
-            response = requests.get(url, headers=headers, timeout=30)
+            # requests blocks for up to the timeout; keep it off the event loop
+            response = await asyncio.to_thread(requests.get, url, headers=headers, timeout=30)
             
             if response.status_code == 200:
                 datasets = response.json()
@@ -44,7 +46,7 @@ class DatasetVisualizationService:
                 headers["Authorization"] = f"Bearer {token}"
             
             url = f"{self.base_url}/datasets/{dataset_id}"
-            response = requests.get(url, headers=headers, timeout=30)
+            response = await asyncio.to_thread(requests.get, url, headers=headers, timeout=30)
             
             if response.status_code == 200:
                 dataset = response.json()
@@ -72,7 +74,7 @@ class DatasetVisualizationService:
             if username:
                 url += f"&author={username}"
             
-            response = requests.get(url, headers=headers, timeout=30)
+            response = await asyncio.to_thread(requests.get, url, headers=headers, timeout=30)
             
             if response.status_code == 200:
                 datasets = response.json()
@@ -20,6 +20,7 @@ import time
 import subprocess
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Global camera stream tracking
 active_camera_streams = {}
@@ -27,6 +28,8 @@ active_camera_streams = {}
 # Configure logging to suppress access logs for health checks
 logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title="LeRobot Calibration API", version="1.0.0")
 
 # Enable CORS for frontend communication
@@ -227,7 +230,7 @@ async def detect_ports():
     Detect and return available USB ports (on-demand detection).
     """
     try:
-        result = await calibration_service_instance.list_ports()
+        result = await calibration_service_instance.list_ports(refresh=True)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to detect ports: {str(e)}")
@@ -238,64 +241,99 @@ async def scan_cameras():
     Scan for available camera devices (USB or built-in) using OpenCV.
     Returns a list of camera indices and suggested names.
     """
-    cameras = []
-    for idx in range(10):  # Scan indices 0-9
-        cap = cv2.VideoCapture(idx)
-        if cap is not None and cap.isOpened():
-            # Get camera properties
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            
-            cameras.append({
-                "id": f"camera{idx}",
-                "name": f"Camera {idx}",
-                "index": idx,
-                "url": f"/video/camera/{idx}",  # This is a placeholder; frontend can use index
-                "width": width,
-                "height": height,
-                "fps": fps if fps > 0 else 30,
-            })
-            cap.release()
+    # Opening capture devices blocks for a long time per index; keep it off the event loop
+    cameras = await asyncio.to_thread(_scan_camera_indices)
     return {"cameras": cameras}
 
-def mjpeg_stream_generator(index):
+# Camera indices probed by /scan-cameras
+CAMERA_SCAN_INDICES = range(10)
+
+def _probe_camera(idx):
+    cap = cv2.VideoCapture(idx)
+    if cap is None or not cap.isOpened():
+        return None
+    try:
+        # Get camera properties
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        
+        return {
+            "id": f"camera{idx}",
+            "name": f"Camera {idx}",
+            "index": idx,
+            "url": f"/video/camera/{idx}",  # This is a placeholder; frontend can use index
+            "width": width,
+            "height": height,
+            "fps": fps if fps > 0 else 30,
+        }
+    finally:
+        cap.release()
+
+def _scan_camera_indices():
+    # Opening a device can take hundreds of ms and cv2 releases the GIL while it waits,
+    # so probe all indices at once; map() keeps the results in index order
+    with ThreadPoolExecutor(max_workers=len(CAMERA_SCAN_INDICES)) as executor:
+        return [camera for camera in executor.map(_probe_camera, CAMERA_SCAN_INDICES) if camera is not None]
+
+def mjpeg_stream_generator(index, max_width: Optional[int] = None):
     cap = cv2.VideoCapture(index)
     if not cap.isOpened():
         print(f"Failed to open camera {index}")
         return
     
+    # Keep only the newest frame in the driver queue so the stream never lags behind
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    
     # Get camera's native resolution
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    # Optional downscale for constrained links; otherwise frames go out at native size
+    out_size = None
+    if max_width and 0 < max_width < width:
+        out_size = (max_width, max(1, round(height * max_width / width)))
     print(f"Started MJPEG stream for camera {index} at {width}x{height}")
     
     # Store the capture object globally
     active_camera_streams[index] = cap
     
+    # Decode and resize targets reused across frames instead of allocating new images each time
+    frame = None
+    scaled = None
+    # A client slower than this leaves a stale frame queued in the driver
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_interval = 1.0 / fps if fps > 0 else 1.0 / 30
+    stale = False
     try:
         while index in active_camera_streams:  # Check if stream is still active
-            ret, frame = cap.read()
+            if stale:
+                # grab() without retrieve() drops the stale frame without decoding it
+                cap.grab()
+            ret = cap.grab()
+            if ret:
+                ret, frame = cap.retrieve(frame)
             if not ret:
                 print(f"Failed to read frame from camera {index}")
+                # Back off briefly so a failing device doesn't spin this thread
+                time.sleep(0.01)
                 continue
             
-            # Use native camera resolution
-            frame = cv2.resize(frame, (width, height))
+            image = frame
+            if out_size is not None:
+                scaled = cv2.resize(frame, out_size, dst=scaled, interpolation=cv2.INTER_AREA)
+                image = scaled
             
-            ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+            ret, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 80])
             if not ret:
                 print(f"Failed to encode frame from camera {index}")
                 continue
             
-            frame_bytes = jpeg.tobytes()
-            
-            # Simpler MJPEG format that browsers handle better
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            
-            # Small delay to control frame rate
-            time.sleep(0.033)  # ~30 FPS
+            sent_at = time.monotonic()
+            # Simpler MJPEG format that browsers handle better. join() reads the
+            # encoder's buffer directly, so the frame is copied once into the part
+            yield b''.join((b'--frame\r\nContent-Type: image/jpeg\r\n\r\n', jpeg, b'\r\n'))
+            # No extra sleep: grab() already blocks until the camera delivers the next frame
+            stale = time.monotonic() - sent_at > frame_interval
             
     except GeneratorExit:
         print(f"Client disconnected from camera {index} stream")
@@ -308,27 +346,45 @@ def mjpeg_stream_generator(index):
         print(f"Stopped MJPEG stream for camera {index}")
 
 @app.get("/video/camera/{index}")
-async def video_camera(index: int, response: Response):
+async def video_camera(index: int, response: Response, max_width: Optional[int] = None):
     """
     MJPEG video stream from the specified camera index.
+    Pass max_width to downscale frames before encoding.
     """
     response.headers["Access-Control-Allow-Origin"] = "*"
     response.headers["Access-Control-Allow-Methods"] = "GET"
     response.headers["Access-Control-Allow-Headers"] = "*"
     response.headers["Cache-Control"] = "no-cache"
-    response.headers["Connection"] = "close"
     
     return StreamingResponse(
-        mjpeg_stream_generator(index), 
+        mjpeg_stream_generator(index, max_width), 
         media_type='multipart/x-mixed-replace; boundary=frame'
     )
 
+# Idle WebSocket polls that only yield to the loop before switching to timed sleeps
+POLL_SPIN_ITERATIONS = 10
+# Sleep between polls once a session has been idle for POLL_SPIN_ITERATIONS; kept at
+# the old fixed 10 ms so idle-to-output latency and teleop table refreshes don't regress
+POLL_IDLE_INTERVAL = 0.01
+
+async def _poll_pause(idle_polls: int):
+    """
+    Pause between WebSocket polls: yield without a timer right after activity, then back off
+    """
+    if idle_polls < POLL_SPIN_ITERATIONS:
+        await asyncio.sleep(0)
+    else:
+        await asyncio.sleep(POLL_IDLE_INTERVAL)
+
+# Upper bound on lines per output_batch frame, so one frame never grows unbounded
+OUTPUT_BATCH_SIZE = 256
+
 # WebSocket endpoint for real-time output streaming
 @app.websocket("/ws/calibration/{session_id}")
 async def websocket_calibration(websocket: WebSocket, session_id: str):
-    print(f"WebSocket connection request for session {session_id}")
+    logger.debug("WebSocket connection request for session %s", session_id)
     await websocket.accept()
-    print(f"WebSocket connection opened for session {session_id}")
+    logger.debug("WebSocket connection opened for session %s", session_id)
     
     message_count = 0
     
@@ -338,9 +394,9 @@ async def websocket_calibration(websocket: WebSocket, session_id: str):
             "type": "status",
             "data": {"message": "WebSocket connected", "session_id": session_id}
         }
-        print(f"Sending initial message: {initial_message}")
+        logger.debug("Sending initial message: %s", initial_message)
         await websocket.send_text(json.dumps(initial_message))
-        print(f"Initial message sent successfully")
+        logger.debug("Initial message sent successfully")
         message_count += 1
         
         while True:
@@ -349,68 +405,70 @@ async def websocket_calibration(websocket: WebSocket, session_id: str):
             
             if not is_running:
                 # Process has finished
-                print(f"Process finished for {session_id}")
+                logger.debug("Process finished for %s", session_id)
                 try:
                     await websocket.send_text(json.dumps({
                         "type": "status",
                         "data": {"is_running": False, "status": "finished"}
                     }))
                 except Exception as e:
-                    print(f"Failed to send finish message for {session_id}: {e}")
+                    logger.warning("Failed to send finish message for %s: %s", session_id, e)
                 break
             
             # Get all available output messages at once
             outputs = await calibration_service_instance.get_all_output(session_id)
             if outputs:
-                print(f"Retrieved {len(outputs)} outputs for {session_id}")
-                for output in outputs:
-                    message_count += 1
-                    print(f"Sending output #{message_count} to WebSocket for {session_id}: {output}")
-                    try:
+                logger.debug("Retrieved %d outputs for %s", len(outputs), session_id)
+                try:
+                    # One frame per drained burst (capped per frame) instead of one per line
+                    for start in range(0, len(outputs), OUTPUT_BATCH_SIZE):
+                        batch = outputs[start:start + OUTPUT_BATCH_SIZE]
+                        message_count += len(batch)
                         await websocket.send_text(json.dumps({
-                            "type": "output",
-                            "data": output.strip()
+                            "type": "output_batch",
+                            "data": [output.strip() for output in batch]
                         }))
-                    except Exception as e:
-                        print(f"Failed to send output message for {session_id}: {e}")
-                        # If we can't send, the connection is likely closed
+                except Exception as e:
+                    logger.warning("Failed to send output message for %s: %s", session_id, e)
+                    # If we can't send, the connection is likely closed
+                    break
+                
+                # Check if this output indicates completion
+                if any("Calibration completed successfully" in output or "Calibration saved to" in output
+                       for output in outputs):
+                    # Double-check if process is really finished
+                    is_running = await calibration_service_instance.is_running(session_id)
+                    if not is_running:
+                        logger.debug("Process confirmed finished for %s after completion output", session_id)
+                        try:
+                            await websocket.send_text(json.dumps({
+                                "type": "status",
+                                "data": {"is_running": False, "status": "finished"}
+                            }))
+                        except Exception as e:
+                            logger.warning("Failed to send completion message for %s: %s", session_id, e)
                         break
-                    
-                    # Check if this output indicates completion
-                    if "Calibration completed successfully" in output or "Calibration saved to" in output:
-                        # Double-check if process is really finished
-                        is_running = await calibration_service_instance.is_running(session_id)
-                        if not is_running:
-                            print(f"Process confirmed finished for {session_id} after completion output")
-                            try:
-                                await websocket.send_text(json.dumps({
-                                    "type": "status",
-                                    "data": {"is_running": False, "status": "finished"}
-                                }))
-                            except Exception as e:
-                                print(f"Failed to send completion message for {session_id}: {e}")
-                            break
             
-            # Wait a bit before checking again (reduced delay for more responsive output)
-            await asyncio.sleep(0.01)
+            # Sleep until the service queues more output instead of polling on a timer
+            await calibration_service_instance.wait_for_output(session_id)
             
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected for session {session_id}")
+        logger.debug("WebSocket disconnected for session %s", session_id)
     except Exception as e:
-        print(f"WebSocket error for {session_id}: {e}")
+        logger.warning("WebSocket error for %s: %s", session_id, e)
         try:
             await websocket.send_text(json.dumps({
                 "type": "error",
                 "data": str(e)
             }))
         except Exception as send_error:
-            print(f"Failed to send error message for {session_id}: {send_error}")
+            logger.warning("Failed to send error message for %s: %s", session_id, send_error)
     finally:
         try:
             await websocket.close()
         except Exception as close_error:
-            print(f"Error closing WebSocket for {session_id}: {close_error}")
-        print(f"WebSocket connection closed for session {session_id}, sent {message_count} messages total")
+            logger.warning("Error closing WebSocket for %s: %s", session_id, close_error)
+        logger.debug("WebSocket connection closed for session %s, sent %d messages total", session_id, message_count)
 
 @app.post("/teleop/start")
 async def start_teleoperation(request: TeleoperationRequest):
@@ -460,6 +518,7 @@ async def websocket_teleoperation(websocket: WebSocket, session_id: str):
     await websocket.accept()
     message_count = 0
     last_table_sent = None
+    idle_polls = 0
     try:
         initial_message = {
             "type": "status",
@@ -481,6 +540,7 @@ async def websocket_teleoperation(websocket: WebSocket, session_id: str):
             
             # Get regular outputs (non-table)
             outputs = await teleoperation_service_instance.get_all_output(session_id)
+            idle_polls = 0 if outputs else idle_polls + 1
             if outputs:
                 for output in outputs:
                     message_count += 1
@@ -501,10 +561,11 @@ async def websocket_teleoperation(websocket: WebSocket, session_id: str):
                         "data": latest_table
                     }))
                     last_table_sent = latest_table
+                    idle_polls = 0
                 except Exception as e:
                     break
             
-            await asyncio.sleep(0.01)
+            await _poll_pause(idle_polls)
     except WebSocketDisconnect:
         pass
     except Exception as e:
@@ -521,17 +582,22 @@ async def websocket_teleoperation(websocket: WebSocket, session_id: str):
         except Exception:
             pass
 
+def _camera_available(index: int) -> bool:
+    cap = cv2.VideoCapture(index)
+    try:
+        return cap.isOpened()
+    finally:
+        cap.release()
+
 @app.post("/camera/{index}/start")
 async def start_camera_stream(index: int):
     """Start streaming from a specific camera"""
     if index in active_camera_streams:
         return {"success": True, "message": f"Camera {index} stream already active"}
     
-    # Test if camera can be opened
-    cap = cv2.VideoCapture(index)
-    if not cap.isOpened():
+    # Test if camera can be opened; opening a device blocks, so keep it off the event loop
+    if not await asyncio.to_thread(_camera_available, index):
         return {"success": False, "message": f"Camera {index} not available"}
-    cap.release()
     
     return {"success": True, "message": f"Camera {index} stream started"}
 
@@ -606,6 +672,7 @@ async def websocket_motor_setup(websocket: WebSocket, session_id: str):
         print(f"Initial message sent successfully")
         message_count += 1
         
+        idle_polls = 0
         while True:
             # Check if process is still running
             is_running = await motor_setup_service.is_running(session_id)
@@ -624,6 +691,7 @@ async def websocket_motor_setup(websocket: WebSocket, session_id: str):
             
             # Get all available output messages at once
             outputs = await motor_setup_service.get_all_output(session_id)
+            idle_polls = 0 if outputs else idle_polls + 1
             if outputs:
                 print(f"Retrieved {len(outputs)} outputs for {session_id}")
                 for output in outputs:
@@ -639,8 +707,8 @@ async def websocket_motor_setup(websocket: WebSocket, session_id: str):
                         # If we can't send, the connection is likely closed
                         break
             
-            # Wait a bit before checking again (reduced delay for more responsive output)
-            await asyncio.sleep(0.01)
+            # Wait a bit before checking again
+            await _poll_pause(idle_polls)
             
     except WebSocketDisconnect:
         print(f"Motor setup WebSocket disconnected for session {session_id}")
@@ -788,6 +856,7 @@ async def websocket_dataset_recording(websocket: WebSocket, session_id: str):
             "data": {"message": "WebSocket connected", "session_id": session_id}
         }))
         
+        idle_polls = 0
         while True:
             # Check if process is still running
             is_running = await dataset_recording_service_instance.is_running(session_id)
@@ -802,6 +871,7 @@ async def websocket_dataset_recording(websocket: WebSocket, session_id: str):
             
             # Get all available output messages at once
             outputs = await dataset_recording_service_instance.get_all_output(session_id)
+            idle_polls = 0 if outputs else idle_polls + 1
             if outputs:
                 for output in outputs:
                     try:
@@ -814,7 +884,7 @@ async def websocket_dataset_recording(websocket: WebSocket, session_id: str):
                         break
             
             # Wait a bit before checking again
-            await asyncio.sleep(0.01)
+            await _poll_pause(idle_polls)
             
     except WebSocketDisconnect:
         pass
@@ -902,6 +972,7 @@ async def websocket_dataset_replay(websocket: WebSocket, session_id: str):
             "data": {"message": "WebSocket connected", "session_id": session_id}
         }))
         
+        idle_polls = 0
         while True:
             # Check if process is still running
             is_running = await dataset_replay_service_instance.is_running(session_id)
@@ -916,6 +987,7 @@ async def websocket_dataset_replay(websocket: WebSocket, session_id: str):
             
             # Get all available output messages at once
             outputs = await dataset_replay_service_instance.get_all_output(session_id)
+            idle_polls = 0 if outputs else idle_polls + 1
             if outputs:
                 for output in outputs:
                     try:
@@ -928,7 +1000,7 @@ async def websocket_dataset_replay(websocket: WebSocket, session_id: str):
                         break
             
             # Wait a bit before checking again
-            await asyncio.sleep(0.01)
+            await _poll_pause(idle_polls)
             
     except WebSocketDisconnect:
         pass
@@ -1083,4 +1155,8 @@ async def clear_training_output():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # The dashboard polls status endpoints every few seconds; keep idle
+    # connections open longer than uvicorn's 5 s default so polls reuse them.
+    # uvicorn[standard] already selects httptools and uvloop when installed.
+    # Only applies to this entrypoint; `uvicorn main:app` needs --timeout-keep-alive 30.
+    uvicorn.run(app, host="0.0.0.0", port=8000, timeout_keep_alive=30)
\ No newline at end of file
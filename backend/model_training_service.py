@@ -13,7 +13,7 @@ import re
 # Import the function to get HF environment variables
 from backend.env_manager import get_hf_env_for_cli
 
-@dataclass
+@dataclass(slots=True)
 class TrainingConfig:
     dataset_repo_id: str
     policy_type: str
@@ -129,7 +129,9 @@ class ModelTrainingService:
             "is_running": self.is_running,
             "is_completed": self.is_completed,
             "error": self.error_message,
-            "output": self.output_buffer.copy(),
+            # Returned without a defensive copy: callers treat it as read-only, and the
+            # /model-training/status response model already builds its own list from it
+            "output": self.output_buffer,
             "start_time": self.start_time.isoformat() if self.start_time else None,
             "wandb_link": self._extract_wandb_link()
         }
@@ -1,32 +1,42 @@
 import os
-import sys
-import queue
+import re
+import itertools
 import threading
 import subprocess
 import logging
 from datetime import datetime
 import pty
-import select
+import selectors
 import time
+from collections import deque
+from sys import executable as _PYTHON
 
 # Import the function to get HF environment variables
 from backend.env_manager import get_hf_env_for_cli
 
+_ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
 class MotorSetupService:
     def __init__(self):
         self.active_sessions = {}   # session_id -> session_data
-        self.output_queues = {}     # session_id -> Queue
         self.active_processes = {}  # session_id -> (process, master_fd)
         self.cancelled_sessions = set()
+        # One bounded buffer of (seq, session_id, output) shared by all sessions
+        self._shared_output = deque(maxlen=100_000)
+        self._output_cursors = {}   # session_id -> last seq returned by get_all_output
+        self._dropped_output = {}   # session_id -> unread entries evicted from the shared buffer
+        self._output_seq = itertools.count(1)
+        self._output_lock = threading.Lock()
 
     async def start_motor_setup(self, robot_type: str, port: str) -> str:
         try:
-            session_id = f"{robot_type}_{port.replace('/', '_')}_{int(time.time())}"
+            session_id = self._generate_session_id(robot_type, port)
             if session_id in self.active_processes:
                 logging.warning(f"Session {session_id} already exists, cleaning up")
                 await self.stop_motor_setup(session_id)
             self.cancelled_sessions.discard(session_id)
-            self.output_queues[session_id] = queue.Queue()
+            with self._output_lock:
+                self._output_cursors[session_id] = self._shared_output[-1][0] if self._shared_output else 0
             self.active_sessions[session_id] = {
                 "robot_type": robot_type,
                 "port": port,
@@ -34,13 +44,11 @@ class MotorSetupService:
                 "start_time": datetime.now(),
                 "output": []
             }
-            command = [
-                sys.executable, "-u", "-m", "lerobot.setup_motors",
-                f"--robot.type={robot_type}",
-                f"--robot.port={port}"
-            ]
+            command = self._build_motor_setup_command(robot_type, port)
             logging.info(f"Executing motor setup command: {' '.join(command)}")
             master_fd, slave_fd = pty.openpty()
+            # Non-blocking master: the monitor reads until EAGAIN and only then waits for readiness
+            os.set_blocking(master_fd, False)
             
             # Get environment variables for CLI commands
             cli_env = get_hf_env_for_cli()
@@ -73,34 +81,74 @@ class MotorSetupService:
             raise
 
     def _add_output(self, session_id, output):
-        if session_id in self.output_queues:
-            self.output_queues[session_id].put(output)
+        if session_id in self._output_cursors:
+            with self._output_lock:
+                shared = self._shared_output
+                if len(shared) == shared.maxlen:
+                    # This append evicts the oldest entry; remember it if its session never read it
+                    seq, sid, _ = shared[0]
+                    if seq > self._output_cursors.get(sid, seq):
+                        self._dropped_output[sid] = self._dropped_output.get(sid, 0) + 1
+                shared.append((next(self._output_seq), session_id, output))
         if session_id in self.active_sessions:
             self.active_sessions[session_id]["output"].append(output)
 
+    def _generate_session_id(self, robot_type: str, port: str) -> str:
+        # Port and start time keep setups on different ports (and restarts) apart
+        return f"{robot_type}_{port.replace('/', '_')}_{int(time.time())}_motor_setup"
+
+    def _build_motor_setup_command(self, robot_type: str, port: str) -> list:
+        return [
+            _PYTHON, "-u", "-m", "lerobot.setup_motors",
+            f"--robot.type={robot_type}",
+            f"--robot.port={port}"
+        ]
+
+    def _drain_pty(self, session_id: str, master_fd: int, read_buf: memoryview) -> bool:
+        """Read everything currently buffered on the PTY; returns False once it is closed"""
+        while True:
+            try:
+                # Read into the session's reusable buffer rather than a new bytes per chunk
+                n = os.readv(master_fd, [read_buf])
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            if not n:
+                return False
+            output = self._clean_ansi_codes(str(read_buf[:n], 'utf-8', 'replace'))
+            self._add_output(session_id, output)
+            logging.info(f"Motor setup output: {output.rstrip()}")
+            if any(trigger in output.lower() for trigger in ["press enter", "hit enter", "press <enter>", "press return"]):
+                self.active_sessions[session_id]["waiting_for_input"] = True
+
+    def _clean_ansi_codes(self, text: str) -> str:
+        # The containment check is a single memchr-style scan; most chunks carry no escapes
+        if '\x1b' not in text:
+            return text
+        return _ANSI_ESCAPE.sub('', text)
+
     def _monitor_motor_setup_subprocess(self, session_id: str):
         try:
             process, master_fd = self.active_processes[session_id]
             self.active_sessions[session_id]["status"] = "running"
             logging.info(f"Starting to monitor motor setup (PTY) for {session_id}")
-            waiting_detected = False
-            while True:
-                rlist, _, _ = select.select([master_fd], [], [], 0.1)
-                if master_fd in rlist:
-                    try:
-                        output = os.read(master_fd, 1024).decode(errors='replace')
-                        if output:
-                            self._add_output(session_id, output)
-                            logging.info(f"Motor setup output: {output.rstrip()}")
-                            if any(trigger in output.lower() for trigger in ["press enter", "hit enter", "press <enter>", "press return"]):
-                                waiting_detected = True
-                                self.active_sessions[session_id]["waiting_for_input"] = True
-                    except OSError:
+            # epoll/kqueue where available: the fd is registered once instead of
+            # copying an fd set into the kernel on every wait
+            read_buf = memoryview(bytearray(4096))
+            with selectors.DefaultSelector() as selector:
+                selector.register(master_fd, selectors.EVENT_READ)
+                while True:
+                    if not self._drain_pty(session_id, master_fd, read_buf):
                         break
-                if process.poll() is not None:
-                    break
-                time.sleep(0.01)
-            if process.poll() == 0:
+                    if process.poll() is not None:
+                        # Pick up anything written between the last read and exit
+                        self._drain_pty(session_id, master_fd, read_buf)
+                        break
+                    # Only block on readiness once the PTY has been drained to EAGAIN
+                    selector.select(timeout=0.1)
+            exit_code = process.wait()
+            if exit_code == 0:
                 if session_id in self.cancelled_sessions:
                     self._add_output(session_id, "Motor setup cancelled by user")
                     logging.info(f"Motor setup cancelled by user for {session_id}")
@@ -116,16 +164,30 @@ class MotorSetupService:
                 else:
                     if session_id in self.active_sessions:
                         self.active_sessions[session_id]["status"] = "failed"
-                    self._add_output(session_id, f"Motor setup failed with exit code {process.poll()}")
-                    logging.error(f"Motor setup failed for {session_id} with exit code {process.poll()}")
+                    self._add_output(session_id, f"Motor setup failed with exit code {exit_code}")
+                    logging.error(f"Motor setup failed for {session_id} with exit code {exit_code}")
         except Exception as e:
             logging.error(f"Error monitoring motor setup for {session_id}: {e}")
 
     async def get_all_output(self, session_id: str):
+        if session_id not in self._output_cursors:
+            return []
         outputs = []
-        if session_id in self.output_queues:
-            while not self.output_queues[session_id].empty():
-                outputs.append(self.output_queues[session_id].get())
+        with self._output_lock:
+            cursor = self._output_cursors[session_id]
+            # Walk back from the newest entry until we reach what was already returned
+            for seq, sid, output in reversed(self._shared_output):
+                if seq <= cursor:
+                    break
+                if sid == session_id:
+                    outputs.append(output)
+            if self._shared_output:
+                self._output_cursors[session_id] = self._shared_output[-1][0]
+            dropped = self._dropped_output.pop(session_id, 0)
+        outputs.reverse()
+        if dropped:
+            logging.warning(f"{dropped} output chunks for {session_id} were evicted before they were read")
+            outputs.insert(0, f"[{dropped} earlier output chunks were dropped]\n")
         return outputs
 
     async def is_running(self, session_id: str) -> bool:
@@ -175,14 +237,21 @@ class MotorSetupService:
                     logging.warning(f"Force killing process for {session_id}")
                     process.kill()
                     process.wait(timeout=2)
-            if session_id in self.active_processes:
-                del self.active_processes[session_id]
-            if session_id in self.output_queues:
-                del self.output_queues[session_id]
-            if session_id in self.active_sessions:
-                del self.active_sessions[session_id]
+            self._cleanup_session(session_id)
             logging.info(f"Stopped motor setup process for {session_id}")
             return True
         except Exception as e:
             logging.error(f"Failed to stop motor setup {session_id}: {e}")
-            return False 
\ No newline at end of file
+            return False 
+
+    def _cleanup_session(self, session_id: str):
+        self.active_processes.pop(session_id, None)
+        with self._output_lock:
+            self._output_cursors.pop(session_id, None)
+            self._dropped_output.pop(session_id, None)
+            # Free the stopped session's unread output now rather than when it is evicted
+            self._shared_output = deque(
+                (entry for entry in self._shared_output if entry[1] != session_id),
+                maxlen=self._shared_output.maxlen
+            )
+        self.active_sessions.pop(session_id, None)
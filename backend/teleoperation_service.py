@@ -1,12 +1,11 @@
+import asyncio
+import functools
 import subprocess
-import threading
 import queue
 from datetime import datetime
 import logging
 import os
 import pty
-import select
-import time
 import json
 import re
 import sys
@@ -16,6 +15,49 @@ from backend.env_manager import get_hf_env_for_cli
 
 logger = logging.getLogger(__name__)
 
+# ANSI escape sequences, compiled once rather than on every output line
+_ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+# Longest unterminated output held back waiting for a line end
+_MAX_PARTIAL_LINE = 65536
+
+# Camera request fields that end up in the --robot.cameras argument
+_CAMERA_ARGV_FIELDS = ('name', 'type', 'index', 'width', 'height', 'fps')
+
+@functools.lru_cache(maxsize=32, typed=True)
+def _teleoperation_argv(leader_type: str, leader_port: str, leader_id: str,
+                        follower_type: str, follower_port: str, follower_id: str,
+                        cameras_key: tuple) -> tuple:
+    """Build the teleoperation argv once per distinct configuration"""
+    command = [
+        sys.executable, "-m", "lerobot.teleoperate",
+        f"--robot.type={follower_type}",
+        f"--robot.port={follower_port}",
+        f"--robot.id={follower_id}",
+        f"--teleop.type={leader_type}",
+        f"--teleop.port={leader_port}",
+        f"--teleop.id={leader_id}"
+    ]
+
+    # Add camera configuration if cameras are provided
+    if cameras_key:
+        camera_config = {}
+        for i, camera_items in enumerate(cameras_key):
+            camera = {field: value for field, _, value in camera_items}
+            camera_name = camera.get('name', f'camera_{i}')
+            camera_config[camera_name] = {
+                'type': camera.get('type', 'opencv'),
+                'index_or_path': camera.get('index', 0),
+                'width': camera.get('width', 1920),
+                'height': camera.get('height', 1080),
+                'fps': camera.get('fps', 30)
+            }
+        
+        camera_json = json.dumps(camera_config)
+        command.append(f"--robot.cameras={camera_json}")
+        command.append("--display_data=true")
+    return tuple(command)
+
 class TeleoperationService:
     def __init__(self):
         self.active_sessions = {}   # session_id -> session_data
@@ -23,12 +65,15 @@ class TeleoperationService:
         self.active_processes = {}  # session_id -> (process, master_fd)
         self.cancelled_sessions = set()  # Track cancelled sessions
         self.last_table_output = {}  # Track last table output per session
+        self._pty_state = {}        # master_fd -> owning process, partial line and table parsing state
+        self._exit_watchers = {}    # master_fd -> task waiting for the process to exit
 
     def _clean_ansi_codes(self, text: str) -> str:
         """Remove ANSI escape codes from text"""
-        # Remove ANSI escape sequences
-        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        return ansi_escape.sub('', text)
+        # Plain lines are the common case; skip the regex when there is no escape byte
+        if '\x1b' not in text:
+            return text
+        return _ANSI_ESCAPE.sub('', text)
 
     def _process_table_output(self, session_id: str, text: str) -> str:
         """Process table output to avoid repetition"""
@@ -54,6 +99,21 @@ class TeleoperationService:
             # For non-table output, return as is
             return cleaned_text
 
+    def _build_teleoperation_command(self, leader_type: str, leader_port: str, leader_id: str,
+                                     follower_type: str, follower_port: str, follower_id: str,
+                                     cameras: list = None) -> list:
+        # Key only on the fields the argv uses; anything else in the request is ignored.
+        # The value's type is part of the key since 30, 30.0 and True hash alike but
+        # serialise differently, and typed=True does not look inside tuples
+        cameras_key = tuple(
+            tuple((field, type(camera[field]), camera[field]) for field in _CAMERA_ARGV_FIELDS if field in camera)
+            for camera in cameras or []
+        )
+        # A fresh list each time so callers may extend it without touching the cache
+        return list(_teleoperation_argv(leader_type, leader_port, leader_id,
+                                        follower_type, follower_port, follower_id,
+                                        cameras_key))
+
     async def start_teleoperation(self, leader_type: str, leader_port: str, leader_id: str,
                                   follower_type: str, follower_port: str, follower_id: str,
                                   cameras: list = None) -> str:
@@ -72,7 +132,8 @@ class TeleoperationService:
             self.cancelled_sessions.discard(session_id)
 
             # Create output queue for this session
-            self.output_queues[session_id] = queue.Queue()
+            # Only ever polled with get_nowait(), so the C SimpleQueue is enough; no waiter futures
+            self.output_queues[session_id] = queue.SimpleQueue()
 
             # Store session info
             self.active_sessions[session_id] = {
@@ -89,32 +150,11 @@ class TeleoperationService:
             }
 
             # Build the teleoperation command
-            command = [
-                sys.executable, "-m", "lerobot.teleoperate",
-                f"--robot.type={follower_type}",
-                f"--robot.port={follower_port}",
-                f"--robot.id={follower_id}",
-                f"--teleop.type={leader_type}",
-                f"--teleop.port={leader_port}",
-                f"--teleop.id={leader_id}"
-            ]
-
-            # Add camera configuration if cameras are provided
-            if cameras and len(cameras) > 0:
-                camera_config = {}
-                for i, camera in enumerate(cameras):
-                    camera_name = camera.get('name', f'camera_{i}')
-                    camera_config[camera_name] = {
-                        'type': camera.get('type', 'opencv'),
-                        'index_or_path': camera.get('index', 0),
-                        'width': camera.get('width', 1920),
-                        'height': camera.get('height', 1080),
-                        'fps': camera.get('fps', 30)
-                    }
-                
-                camera_json = json.dumps(camera_config)
-                command.append(f"--robot.cameras={camera_json}")
-                command.append("--display_data=true")
+            command = self._build_teleoperation_command(
+                leader_type, leader_port, leader_id,
+                follower_type, follower_port, follower_id,
+                cameras
+            )
 
             logger.info(f"Executing teleoperation command: {' '.join(command)}")
 
@@ -141,12 +181,7 @@ class TeleoperationService:
             self.active_processes[session_id] = (process, master_fd)
             self._add_output(session_id, f"Teleoperation started for leader {leader_id} and follower {follower_id}")
 
-            thread = threading.Thread(
-                target=self._monitor_teleoperation_subprocess,
-                args=(session_id,),
-                daemon=True
-            )
-            thread.start()
+            self._watch_pty(session_id, process, master_fd)
 
             logger.info(f"Started teleoperation process for {session_id}")
             return session_id
@@ -154,74 +189,154 @@ class TeleoperationService:
             logger.error(f"Failed to start teleoperation: {e}")
             raise
 
-    def _monitor_teleoperation_subprocess(self, session_id: str):
+    def _watch_pty(self, session_id: str, process, master_fd: int):
+        """Read the session's PTY from the event loop and wait for the process to exit"""
+        os.set_blocking(master_fd, False)
+        # Keyed by fd, not session id: a restart reuses the session id while the old
+        # process's watcher may still be finishing up
+        state = {"process": process, "partial": bytearray(), "table_buffer": [], "in_table": False}
+        self._pty_state[master_fd] = state
+        asyncio.get_running_loop().add_reader(master_fd, self._on_pty_readable, session_id, master_fd)
+        self.active_sessions[session_id]["status"] = "running"
+        logger.info(f"Watching teleoperation PTY for {session_id}")
+        self._exit_watchers[master_fd] = asyncio.create_task(
+            self._wait_for_teleoperation_exit(session_id, process, master_fd)
+        )
+
+    def _owns_session(self, session_id: str, process) -> bool:
+        """Whether process is still the one running under session_id"""
+        entry = self.active_processes.get(session_id)
+        return entry is not None and entry[0] is process
+
+    def _on_pty_readable(self, session_id: str, master_fd: int):
+        state = self._pty_state.get(master_fd)
+        if state is None:
+            return
+        partial = state["partial"]
+        while True:
+            try:
+                # Large reads so a burst of output costs a handful of syscalls, not one per line
+                data = os.read(master_fd, 65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                data = b''
+            if not data:
+                # Slave side closed; flush the unterminated tail and let the exit watcher report status
+                asyncio.get_running_loop().remove_reader(master_fd)
+                self._flush_partial_line(session_id, state)
+                return
+            partial += data
+        if not self._owns_session(session_id, state["process"]):
+            # Stopped or replaced by a restart: drain the PTY but keep its output out of the new session
+            partial.clear()
+            return
+        # Hand over complete lines only; a line split across writes waits for its newline.
+        # \r counts too, so progress bars that redraw in place still reach the UI
+        end = max(partial.rfind(b'\n'), partial.rfind(b'\r'))
+        if end < 0:
+            if len(partial) < _MAX_PARTIAL_LINE:
+                return
+            # No terminator in sight; don't let the tail grow without bound
+            end = len(partial)
         try:
-            process, master_fd = self.active_processes[session_id]
-            self.active_sessions[session_id]["status"] = "running"
-            logger.info(f"Starting to monitor teleoperation (PTY) for {session_id}")
-            last_output_time = time.time()
-            table_buffer = []
-            in_table = False
-            
-            while True:
-                if process.poll() is not None:
-                    logger.info(f"Process finished for {session_id}")
-                    break
-                ready, _, _ = select.select([master_fd], [], [], 0.05)
-                if ready:
-                    try:
-                        data = os.read(master_fd, 4096)
-                        if data:
-                            text_data = data.decode('utf-8', errors='ignore')
-                            lines = text_data.split('\n')
-                            for line in lines:
-                                line = line.strip()
-                                if line:
-                                    # Check if this line starts a new table
-                                    if '---------------------------' in line:
-                                        # If we were already in a table, send the previous one first
-                                        if in_table and table_buffer:
-                                            complete_table = '\n'.join(table_buffer)
-                                            processed_table = self._process_table_output(session_id, complete_table)
-                                            if processed_table is not None:
-                                                self._add_output(session_id, processed_table)
-                                        
-                                        # Start of a new table
-                                        in_table = True
-                                        table_buffer = [line]
-                                    elif in_table:
-                                        # Continue accumulating table lines
-                                        table_buffer.append(line)
-                                        
-                                        # Check if this looks like the end of a table (contains timing info)
-                                        if 'time:' in line and 'ms' in line and '(' in line:
-                                            # End of table, send complete table
-                                            complete_table = '\n'.join(table_buffer)
-                                            processed_table = self._process_table_output(session_id, complete_table)
-                                            if processed_table is not None:
-                                                self._add_output(session_id, processed_table)
-                                            in_table = False
-                                            table_buffer = []
-                                        # Fallback: if we have a substantial table buffer and hit another separator, send it
-                                        elif '---------------------------' in line and len(table_buffer) > 5:
-                                            # We have a substantial table, send it
-                                            complete_table = '\n'.join(table_buffer)
-                                            processed_table = self._process_table_output(session_id, complete_table)
-                                            if processed_table is not None:
-                                                self._add_output(session_id, processed_table)
-                                            in_table = False
-                                            table_buffer = [line]  # Start new table with this line
-                                    else:
-                                        # Non-table output, process normally
-                                        processed_line = self._process_table_output(session_id, line)
-                                        if processed_line is not None:
-                                            self._add_output(session_id, processed_line)
-                            last_output_time = time.time()
-                    except Exception as e:
-                        logger.error(f"PTY read error for {session_id}: {e}")
-                time.sleep(0.05)
+            self._process_pty_text(session_id, state, partial[:end].decode('utf-8', errors='ignore'))
+        except Exception as e:
+            logger.error(f"PTY read error for {session_id}: {e}")
+        del partial[:end + 1]
+
+    def _flush_partial_line(self, session_id: str, state: dict):
+        if state["partial"] and self._owns_session(session_id, state["process"]):
+            self._process_pty_text(session_id, state, state["partial"].decode('utf-8', errors='ignore'))
+        state["partial"].clear()
+
+    def _process_pty_text(self, session_id: str, state: dict, text_data: str):
+        table_buffer = state["table_buffer"]
+        in_table = state["in_table"]
+        # splitlines() breaks on \r as well, so each in-place redraw is its own line
+        for line in text_data.splitlines():
+            line = line.strip()
+            if line:
+                # Check if this line starts a new table
+                if '---------------------------' in line:
+                    # If we were already in a table, send the previous one first
+                    if in_table and table_buffer:
+                        complete_table = '\n'.join(table_buffer)
+                        processed_table = self._process_table_output(session_id, complete_table)
+                        if processed_table is not None:
+                            self._add_output(session_id, processed_table)
+                    
+                    # Start of a new table
+                    in_table = True
+                    table_buffer = [line]
+                elif in_table:
+                    # Continue accumulating table lines
+                    table_buffer.append(line)
+                    
+                    # Check if this looks like the end of a table (contains timing info)
+                    if 'time:' in line and 'ms' in line and '(' in line:
+                        # End of table, send complete table
+                        complete_table = '\n'.join(table_buffer)
+                        processed_table = self._process_table_output(session_id, complete_table)
+                        if processed_table is not None:
+                            self._add_output(session_id, processed_table)
+                        in_table = False
+                        table_buffer = []
+                    # Fallback: if we have a substantial table buffer and hit another separator, send it
+                    elif '---------------------------' in line and len(table_buffer) > 5:
+                        # We have a substantial table, send it
+                        complete_table = '\n'.join(table_buffer)
+                        processed_table = self._process_table_output(session_id, complete_table)
+                        if processed_table is not None:
+                            self._add_output(session_id, processed_table)
+                        in_table = False
+                        table_buffer = [line]  # Start new table with this line
+                else:
+                    # Non-table output, process normally
+                    processed_line = self._process_table_output(session_id, line)
+                    if processed_line is not None:
+                        self._add_output(session_id, processed_line)
+        state["table_buffer"] = table_buffer
+        state["in_table"] = in_table
+
+    async def _wait_for_exit(self, process) -> int:
+        """Wait for the process on the event loop via a pidfd, falling back to a worker thread"""
+        pidfd = None
+        if hasattr(os, "pidfd_open"):
+            try:
+                pidfd = os.pidfd_open(process.pid)
+            except OSError:
+                pidfd = None
+        if pidfd is None:
+            return await asyncio.to_thread(process.wait)
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            if not loop.is_closed():
+                loop.remove_reader(pidfd)
+            os.close(pidfd)
+        # The pidfd is readable once the child has exited, so this only reaps it
+        return process.wait()
+
+    async def _wait_for_teleoperation_exit(self, session_id: str, process, master_fd: int):
+        loop = asyncio.get_running_loop()
+        try:
+            exit_code = await self._wait_for_exit(process)
+            logger.info(f"Process finished for {session_id}")
+            # Pick up anything written between the last readiness callback and exit
+            self._on_pty_readable(session_id, master_fd)
+            state = self._pty_state.get(master_fd)
+            if state is not None:
+                self._flush_partial_line(session_id, state)
+            if not self._owns_session(session_id, process):
+                # stop_teleoperation already cleaned up, or a restart now owns this session id
+                logger.info(f"Teleoperation process for {session_id} was stopped or replaced")
+                return
             # Process has finished
-            if process.poll() == 0:
+            if exit_code == 0:
                 if session_id in self.cancelled_sessions:
                     self._add_output(session_id, "Teleoperation cancelled by user")
                     logger.info(f"Teleoperation cancelled by user for {session_id}")
@@ -237,17 +352,27 @@ class TeleoperationService:
                 else:
                     if session_id in self.active_sessions:
                         self.active_sessions[session_id]["status"] = "failed"
-                    self._add_output(session_id, f"Teleoperation failed with exit code {process.poll()}")
-                    logger.error(f"Teleoperation failed for {session_id} with exit code {process.poll()}")
+                    self._add_output(session_id, f"Teleoperation failed with exit code {exit_code}")
+                    logger.error(f"Teleoperation failed for {session_id} with exit code {exit_code}")
         except Exception as e:
             error_msg = f"Teleoperation monitoring error: {str(e)}"
             logger.error(f"Teleoperation error for {session_id}: {e}")
-            if session_id in self.active_sessions:
+            if session_id in self.active_sessions and self._owns_session(session_id, process):
                 self._add_output(session_id, error_msg)
                 self.active_sessions[session_id]["status"] = "failed"
                 self.active_sessions[session_id]["error"] = str(e)
             else:
                 logger.warning(f"Session {session_id} was already cleaned up, skipping status update")
+        finally:
+            # The loop may already be closed when a pending watcher is collected late
+            if not loop.is_closed():
+                loop.remove_reader(master_fd)
+            self._pty_state.pop(master_fd, None)
+            self._exit_watchers.pop(master_fd, None)
+            try:
+                os.close(master_fd)
+            except OSError:
+                pass
 
     def _add_output(self, session_id: str, message: str):
         if session_id in self.output_queues:
@@ -268,7 +393,7 @@ class TeleoperationService:
                     stored_output.append(message)
             else:
                 # For non-table output, add to queue and stored output
-                self.output_queues[session_id].put(output_data)
+                self.output_queues[session_id].put_nowait(output_data)
                 if session_id in self.active_sessions:
                     self.active_sessions[session_id]["output"].append(message)
         else:
@@ -306,29 +431,28 @@ class TeleoperationService:
             return False
 
     async def is_running(self, session_id: str) -> bool:
-        if session_id not in self.active_sessions:
+        # Polled by the WebSocket loop every tick: a single .get() probe per call
+        session = self.active_sessions.get(session_id)
+        if session is None:
             return False
-        session = self.active_sessions[session_id]
-        return session["status"] in ["starting", "running"]
+        return session["status"] in ("starting", "running")
 
     async def get_all_output(self, session_id: str):
-        if session_id not in self.output_queues:
+        output_queue = self.output_queues.get(session_id)
+        if output_queue is None:
             return []
         outputs = []
         
         # Collect all outputs from the queue
-        while not self.output_queues[session_id].empty():
-            output_data = self.output_queues[session_id].get()
+        while not output_queue.empty():
+            output_data = output_queue.get_nowait()
             outputs.append(output_data["message"])
         
         return outputs
 
     async def get_latest_table(self, session_id: str):
         """Get the latest table output for a session"""
-        if session_id in self.last_table_output:
-            return self.last_table_output[session_id]
-        else:
-            return None
+        return self.last_table_output.get(session_id)
 
 # Global instance
 teleoperation_service = TeleoperationService() 
\ No newline at end of file
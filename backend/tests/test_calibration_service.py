@@ -1,7 +1,14 @@
 import pytest
 import asyncio
+import os
+import pty
+import queue
+import subprocess
+import sys
+import threading
+import time
 from unittest.mock import Mock, patch, AsyncMock, MagicMock
-from backend.calibration_service import CalibrationService, clean_ansi_codes
+from backend.calibration_service import CalibrationService, PORTS_CACHE_TTL, clean_ansi_codes
 
 @pytest.fixture
 def calibration_service():
@@ -18,29 +25,15 @@ def mock_process():
 class TestCleanAnsiCodes:
     """Test the clean_ansi_codes utility function"""
     
-    def test_clean_ansi_codes_basic(self):
-        """Test basic ANSI code cleaning"""
-        text_with_ansi = "\x1B[32mHello\x1B[0m World\x1B[1mBold\x1B[0m"
-        cleaned = clean_ansi_codes(text_with_ansi)
-        assert cleaned == "Hello WorldBold"
-    
-    def test_clean_ansi_codes_no_ansi(self):
-        """Test cleaning text without ANSI codes"""
-        text_without_ansi = "Hello World"
-        cleaned = clean_ansi_codes(text_without_ansi)
-        assert cleaned == "Hello World"
-    
-    def test_clean_ansi_codes_cursor_movement(self):
-        """Test cleaning cursor movement codes"""
-        text_with_cursor = "Hello\x1B[8AWorld\x1B[K"
-        cleaned = clean_ansi_codes(text_with_cursor)
-        assert cleaned == "HelloWorld"
-    
-    def test_clean_ansi_codes_carriage_returns(self):
-        """Test cleaning carriage returns"""
-        text_with_cr = "Hello\rWorld\nTest\r\n"
-        cleaned = clean_ansi_codes(text_with_cr)
-        assert cleaned == "HelloWorld\nTest\n"
+    @pytest.mark.parametrize(("text", "expected"), [
+        ("\x1B[32mHello\x1B[0m World\x1B[1mBold\x1B[0m", "Hello WorldBold"),
+        ("Hello World", "Hello World"),
+        ("Hello\x1B[8AWorld\x1B[K", "HelloWorld"),
+        ("Hello\rWorld\nTest\r\n", "HelloWorld\nTest"),
+    ], ids=["basic", "no_ansi", "cursor_movement", "carriage_returns"])
+    def test_clean_ansi_codes(self, text, expected):
+        """Test ANSI codes, cursor movement and carriage returns are cleaned"""
+        assert clean_ansi_codes(text) == expected
 
 class TestCalibrationServiceInitialization:
     """Test CalibrationService initialization"""
@@ -57,10 +50,11 @@ class TestCalibrationServiceStartCalibration:
     """Test starting calibration processes"""
     
     @pytest.mark.asyncio
+    @patch('backend.calibration_service.os.close')
     @patch('backend.calibration_service.subprocess.Popen')
     @patch('backend.calibration_service.pty.openpty')
     @patch('backend.calibration_service.threading.Thread')
-    async def test_start_calibration_leader_success(self, mock_thread, mock_openpty, mock_popen, calibration_service):
+    async def test_start_calibration_leader_success(self, mock_thread, mock_openpty, mock_popen, mock_close, calibration_service):
         """Test successful leader calibration start"""
         # Setup mocks
         mock_openpty.return_value = (10, 11)  # master_fd, slave_fd
@@ -87,10 +81,11 @@ class TestCalibrationServiceStartCalibration:
         assert mock_thread_instance.start.called
     
     @pytest.mark.asyncio
+    @patch('backend.calibration_service.os.close')
     @patch('backend.calibration_service.subprocess.Popen')
     @patch('backend.calibration_service.pty.openpty')
     @patch('backend.calibration_service.threading.Thread')
-    async def test_start_calibration_follower_success(self, mock_thread, mock_openpty, mock_popen, calibration_service):
+    async def test_start_calibration_follower_success(self, mock_thread, mock_openpty, mock_popen, mock_close, calibration_service):
         """Test successful follower calibration start"""
         # Setup mocks
         mock_openpty.return_value = (10, 11)
@@ -404,9 +399,9 @@ class TestCalibrationServiceInternalMethods:
         # Should not raise exception
         calibration_service._add_output('non_existent', 'Test message')
     
-    @patch('backend.calibration_service.select.select')
+    @patch('backend.calibration_service.selectors.DefaultSelector')
     @patch('backend.calibration_service.os.read')
-    def test_monitor_calibration_subprocess(self, mock_read, mock_select, calibration_service):
+    def test_monitor_calibration_subprocess(self, mock_read, mock_selector_cls, calibration_service):
         """Test the monitoring subprocess method"""
         # Setup mocks
         session_id = 'test_session'
@@ -417,8 +412,9 @@ class TestCalibrationServiceInternalMethods:
         calibration_service.active_processes[session_id] = (mock_process, mock_master_fd)
         calibration_service.active_sessions[session_id] = {'status': 'starting'}
         
-        # Mock select to return ready fd
-        mock_select.return_value = ([mock_master_fd], [], [])
+        # Mock the selector to report the fd as ready
+        mock_select = mock_selector_cls.return_value.__enter__.return_value.select
+        mock_select.return_value = [(Mock(fd=mock_master_fd), 1)]
         mock_read.return_value = b'Test output\n'
         
         # Mock process to finish after one iteration
@@ -427,6 +423,7 @@ class TestCalibrationServiceInternalMethods:
             return 0
         
         mock_process.poll.side_effect = [None, 0]  # First call returns None, second returns 0
+        mock_process.wait.return_value = 0
         
         # Test
         calibration_service._monitor_calibration_subprocess(session_id)
@@ -435,6 +432,69 @@ class TestCalibrationServiceInternalMethods:
         assert mock_select.called
         assert mock_read.called
 
+class TestCalibrationServicePortCache:
+    """Test the list_ports cache and the shared in-flight scan"""
+    
+    @staticmethod
+    def _slow_scan():
+        # Long enough for concurrent callers to queue up behind the lock
+        time.sleep(0.05)
+        return ['/dev/ttyUSB0']
+    
+    @pytest.mark.asyncio
+    @patch('backend.calibration_service._scan_usb_ports', return_value=['/dev/ttyUSB0'])
+    async def test_list_ports_reuses_scan_within_ttl(self, mock_scan, calibration_service):
+        """Test a second listing within the TTL is served from the cache"""
+        first = await calibration_service.list_ports()
+        second = await calibration_service.list_ports()
+        
+        assert first == {'ports': ['/dev/ttyUSB0'], 'count': 1}
+        assert second is first
+        assert mock_scan.call_count == 1
+    
+    @pytest.mark.asyncio
+    @patch('backend.calibration_service._scan_usb_ports', return_value=['/dev/ttyUSB0'])
+    async def test_list_ports_rescans_after_ttl(self, mock_scan, calibration_service):
+        """Test a listing older than the TTL is scanned again"""
+        await calibration_service.list_ports()
+        calibration_service._ports_cache_time -= PORTS_CACHE_TTL + 1
+        mock_scan.return_value = ['/dev/ttyUSB0', '/dev/ttyACM0']
+        
+        result = await calibration_service.list_ports()
+        
+        assert result['count'] == 2
+        assert mock_scan.call_count == 2
+    
+    @pytest.mark.asyncio
+    @patch('backend.calibration_service._scan_usb_ports', return_value=['/dev/ttyUSB0'])
+    async def test_list_ports_refresh_bypasses_cache(self, mock_scan, calibration_service):
+        """Test refresh=True scans even when the cache is fresh"""
+        await calibration_service.list_ports()
+        mock_scan.return_value = []
+        
+        result = await calibration_service.list_ports(refresh=True)
+        
+        assert result == {'ports': [], 'count': 0}
+        assert mock_scan.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_list_ports_share_one_scan(self, calibration_service):
+        """Test callers arriving during a scan wait for it rather than starting their own"""
+        with patch('backend.calibration_service._scan_usb_ports', side_effect=self._slow_scan) as mock_scan:
+            results = await asyncio.gather(*(calibration_service.list_ports() for _ in range(3)))
+        
+        assert mock_scan.call_count == 1
+        assert all(result is results[0] for result in results)
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_refreshes_share_a_later_scan(self, calibration_service):
+        """Test refreshes issued during a scan share the next one, since the running scan may predate them"""
+        with patch('backend.calibration_service._scan_usb_ports', side_effect=self._slow_scan) as mock_scan:
+            results = await asyncio.gather(*(calibration_service.list_ports(refresh=True) for _ in range(3)))
+        
+        assert mock_scan.call_count == 2
+        assert results[1] is results[2]
+
 class TestCalibrationServiceBasicMethods:
     """Test basic service methods"""
     
@@ -479,6 +539,20 @@ class TestCalibrationServiceFileMethods:
         assert 'robot_id' in result
         assert result['robot_id'] == 'test_robot'
     
+    @pytest.mark.asyncio
+    async def test_check_calibration_files_skips_broken_symlink(self, calibration_service, tmp_path):
+        """Test a dangling symlink is skipped instead of failing the whole listing"""
+        robots_dir = tmp_path / ".cache" / "huggingface" / "lerobot" / "calibration" / "robots" / "so101_follower"
+        robots_dir.mkdir(parents=True)
+        (robots_dir / "test_robot.json").write_text("{}")
+        (robots_dir / "test_robot_old.json").symlink_to(robots_dir / "missing.json")
+        
+        with patch('backend.calibration_service.Path.home', return_value=tmp_path):
+            result = await calibration_service.check_calibration_files('test_robot', 'follower')
+        
+        assert 'error' not in result
+        assert [f['name'] for f in result['files']] == ['test_robot.json']
+    
     @pytest.mark.asyncio
     async def test_list_ports_basic(self, calibration_service):
         """Test listing ports returns expected structure"""
@@ -502,4 +576,86 @@ class TestCalibrationServiceInternalMethods:
         
         calibration_service._add_output(session_id, 'Test message')
         
-        assert 'Test message' in calibration_service.active_sessions[session_id]['output'] 
\ No newline at end of file
+        assert 'Test message' in calibration_service.active_sessions[session_id]['output'] 
+
+    def test_monitor_stops_reading_after_pty_hangup(self, calibration_service):
+        """A hung-up PTY ends the read loop instead of spinning until the process exits"""
+        master_fd, slave_fd = pty.openpty()
+        script = "import os, time; print('calibration line', flush=True); os.close(0); os.close(1); os.close(2); time.sleep(0.3)"
+        process = subprocess.Popen([sys.executable, "-c", script], stdin=slave_fd, stdout=slave_fd, stderr=slave_fd)
+        os.close(slave_fd)
+        session_id = 'test_session'
+        calibration_service.active_sessions[session_id] = {'status': 'starting', 'output': []}
+        calibration_service.output_queues[session_id] = queue.Queue()
+        calibration_service.active_processes[session_id] = (process, master_fd)
+        
+        try:
+            with patch('backend.calibration_service.os.read', wraps=os.read) as mock_read:
+                calibration_service._monitor_calibration_subprocess(session_id)
+        finally:
+            os.close(master_fd)
+        
+        # One read for the line, one for the hang-up; other threads share the patched os.read
+        assert sum(1 for call in mock_read.call_args_list if call.args[0] == master_fd) <= 3
+        output = calibration_service.active_sessions[session_id]['output']
+        assert 'calibration line' in output
+        assert output[-1] == 'Calibration completed successfully!'
+
+class TestCalibrationServiceOutputWakeup:
+    """Test waking wait_for_output from the monitor thread and from stop_calibration"""
+    
+    @pytest.fixture
+    async def waiting_session(self, calibration_service):
+        session_id = 'test_session'
+        calibration_service._output_events[session_id] = (asyncio.get_running_loop(), asyncio.Event())
+        calibration_service.active_sessions[session_id] = {'status': 'running', 'output': []}
+        return session_id
+    
+    @pytest.mark.asyncio
+    async def test_output_from_another_thread_wakes_waiter(self, calibration_service, waiting_session):
+        """Test output queued by a worker thread ends the wait well before its timeout"""
+        calibration_service.output_queues[waiting_session] = queue.Queue()
+        waiter = asyncio.ensure_future(calibration_service.wait_for_output(waiting_session, timeout=5))
+        await asyncio.sleep(0)
+        
+        started = time.monotonic()
+        threading.Thread(target=calibration_service._add_output, args=(waiting_session, 'line')).start()
+        await asyncio.wait_for(waiter, 1)
+        
+        assert time.monotonic() - started < 1
+        assert not calibration_service._output_events[waiting_session][1].is_set()
+    
+    @pytest.mark.asyncio
+    async def test_monitor_exit_wakes_waiter(self, calibration_service, waiting_session):
+        """Test the monitor thread wakes the waiter when it finishes, even with no output queued"""
+        read_fd, write_fd = os.pipe()
+        mock_process = Mock()
+        mock_process.poll.return_value = 0
+        mock_process.wait.return_value = 0
+        calibration_service.active_processes[waiting_session] = (mock_process, read_fd)
+        waiter = asyncio.ensure_future(calibration_service.wait_for_output(waiting_session, timeout=5))
+        await asyncio.sleep(0)
+        
+        try:
+            # No output queue, so only the monitor's final notification can end the wait
+            threading.Thread(target=calibration_service._monitor_calibration_subprocess, args=(waiting_session,)).start()
+            await asyncio.wait_for(waiter, 1)
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+        
+        assert calibration_service.active_sessions[waiting_session]['status'] == 'completed'
+    
+    @pytest.mark.asyncio
+    async def test_stop_calibration_wakes_waiter(self, calibration_service, waiting_session):
+        """Test stopping a session wakes its waiter and drops the event"""
+        mock_process = Mock()
+        mock_process.poll.return_value = 0
+        calibration_service.active_processes[waiting_session] = (mock_process, 10)
+        waiter = asyncio.ensure_future(calibration_service.wait_for_output(waiting_session, timeout=5))
+        await asyncio.sleep(0)
+        
+        assert await calibration_service.stop_calibration(waiting_session) is True
+        await asyncio.wait_for(waiter, 1)
+        
+        assert waiting_session not in calibration_service._output_events
@@ -1,5 +1,11 @@
 import pytest
 import asyncio
+import os
+import pty
+import queue
+import subprocess
+import sys
+from unittest.mock import patch
 from backend.dataset_replay_service import DatasetReplayService
 
 @pytest.fixture
@@ -89,4 +95,28 @@ def test_clean_ansi_codes(dataset_replay_service):
     # Test with no ANSI codes
     text_without_ansi = "Hello World"
     cleaned = dataset_replay_service._clean_ansi_codes(text_without_ansi)
-    assert cleaned == "Hello World" 
\ No newline at end of file
+    assert cleaned == "Hello World" 
+
+def test_monitor_stops_reading_after_pty_hangup(dataset_replay_service):
+    """A hung-up PTY ends the read loop instead of spinning until the process exits"""
+    master_fd, slave_fd = pty.openpty()
+    script = "import os, time; print('replay line', flush=True); os.close(0); os.close(1); os.close(2); time.sleep(0.3)"
+    process = subprocess.Popen([sys.executable, "-c", script], stdin=slave_fd, stdout=slave_fd, stderr=slave_fd)
+    os.close(slave_fd)
+    session_id = "test_replay_hangup"
+    dataset_replay_service.active_sessions[session_id] = {"status": "starting", "output": []}
+    dataset_replay_service.output_queues[session_id] = queue.Queue()
+    dataset_replay_service.active_processes[session_id] = (process, master_fd)
+
+    try:
+        with patch("backend.dataset_replay_service.os.read", wraps=os.read) as mock_read:
+            dataset_replay_service._monitor_replay_subprocess(session_id)
+    finally:
+        os.close(master_fd)
+
+    # One read for the line, one for the hang-up; the old loop kept reading until exit
+    # (other tests' monitor threads share the patched os.read, so count this fd only)
+    assert sum(1 for call in mock_read.call_args_list if call.args[0] == master_fd) <= 3
+    output = dataset_replay_service.active_sessions[session_id]["output"]
+    assert "replay line" in output
+    assert output[-1] == "Dataset replay completed successfully!"
@@ -1,7 +1,9 @@
 import warnings
 warnings.filterwarnings("ignore", message="The 'app' shortcut is now deprecated")
 
+import json
 import pytest
+from unittest.mock import AsyncMock, patch
 from fastapi.testclient import TestClient
 from backend import main
 
@@ -82,6 +84,41 @@ class TestCalibrationEndpoints:
         assert 'files' in data
         assert 'cache_directory' in data
 
+class TestCalibrationWebSocket:
+    """Test the calibration output WebSocket"""
+    
+    def _receive_all(self, outputs, is_running):
+        service = main.calibration_service_instance
+        with patch.object(service, 'is_running', AsyncMock(side_effect=is_running)), \
+             patch.object(service, 'get_all_output', AsyncMock(side_effect=outputs)), \
+             patch.object(service, 'wait_for_output', AsyncMock()):
+            with client.websocket_connect('/ws/calibration/session123') as websocket:
+                frames = []
+                while not frames or frames[-1].get('data', {}) != {"is_running": False, "status": "finished"}:
+                    frames.append(json.loads(websocket.receive_text()))
+        return frames
+
+    def test_output_burst_is_chunked_into_batches(self):
+        """Test a drained burst goes out as output_batch frames of at most OUTPUT_BATCH_SIZE lines"""
+        burst = [f"line {i}\n" for i in range(main.OUTPUT_BATCH_SIZE + 44)]
+        frames = self._receive_all([burst, []], [True, True, False])
+        
+        assert frames[0]['type'] == 'status'
+        batches = [frame['data'] for frame in frames if frame['type'] == 'output_batch']
+        assert [len(batch) for batch in batches] == [main.OUTPUT_BATCH_SIZE, 44]
+        assert batches[0][0] == 'line 0'
+        assert sum(batches, []) == [line.strip() for line in burst]
+
+    def test_completion_output_ends_stream(self):
+        """Test completion output followed by a stopped process ends the stream after that batch"""
+        outputs = ["Move all joints\n", "Calibration completed successfully!\n"]
+        # get_all_output is drained only once, so a second pass would fail the test
+        frames = self._receive_all([outputs], [True, False])
+        
+        assert [frame['type'] for frame in frames] == ['status', 'output_batch', 'status']
+        assert frames[1]['data'] == ['Move all joints', 'Calibration completed successfully!']
+        assert frames[2]['data'] == {"is_running": False, "status": "finished"}
+
 class TestPortAndCameraEndpoints:
     """Test port and camera detection endpoints"""
     
@@ -1,5 +1,9 @@
 import pytest
 import asyncio
+import os
+import sys
+import time
+from collections import deque
 from unittest.mock import Mock, patch, AsyncMock, MagicMock
 from backend.motor_setup_service import MotorSetupService
 
@@ -7,6 +11,28 @@ from backend.motor_setup_service import MotorSetupService
 def motor_setup_service():
     return MotorSetupService()
 
+REAL_PTY_LINES = 100_000
+
+@pytest.fixture
+def real_pty_service(monkeypatch):
+    """MotorSetupService driving a real subprocess over a real PTY (no mocks)"""
+    service = MotorSetupService()
+    monkeypatch.setattr(
+        service,
+        "_build_motor_setup_command",
+        lambda robot_type, port: [
+            sys.executable, "-u", "-c",
+            f"for i in range({REAL_PTY_LINES}): print(i)"
+        ]
+    )
+    yield service
+    for session_id in list(service.active_processes):
+        process, master_fd = service.active_processes[session_id]
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        os.close(master_fd)
+
 @pytest.fixture
 def mock_process():
     """Create a mock subprocess process"""
@@ -21,7 +47,8 @@ class TestMotorSetupServiceInitialization:
     def test_initialization(self, motor_setup_service):
         """Test that the service initializes correctly"""
         assert motor_setup_service.active_sessions == {}
-        assert motor_setup_service.output_queues == {}
+        assert len(motor_setup_service._shared_output) == 0
+        assert motor_setup_service._output_cursors == {}
         assert motor_setup_service.active_processes == {}
         assert motor_setup_service.cancelled_sessions == set()
 
@@ -29,10 +56,12 @@ class TestMotorSetupServiceStartMotorSetup:
     """Test starting motor setup processes"""
     
     @pytest.mark.asyncio
+    @patch('backend.motor_setup_service.os.set_blocking')
+    @patch('backend.motor_setup_service.os.close')
     @patch('backend.motor_setup_service.subprocess.Popen')
     @patch('backend.motor_setup_service.pty.openpty')
     @patch('backend.motor_setup_service.threading.Thread')
-    async def test_start_motor_setup_success(self, mock_thread, mock_openpty, mock_popen, motor_setup_service):
+    async def test_start_motor_setup_success(self, mock_thread, mock_openpty, mock_popen, mock_close, mock_set_blocking, motor_setup_service):
         """Test successful motor setup start"""
         # Setup mocks
         mock_openpty.return_value = (10, 11)  # master_fd, slave_fd
@@ -52,17 +81,19 @@ class TestMotorSetupServiceStartMotorSetup:
         assert 'so100' in session_id
         assert 'motor_setup' in session_id
         assert session_id in motor_setup_service.active_sessions
-        assert session_id in motor_setup_service.output_queues
+        assert session_id in motor_setup_service._output_cursors
         assert session_id in motor_setup_service.active_processes
         assert mock_popen.called
         assert mock_thread.called
         assert mock_thread_instance.start.called
     
     @pytest.mark.asyncio
+    @patch('backend.motor_setup_service.os.set_blocking')
+    @patch('backend.motor_setup_service.os.close')
     @patch('backend.motor_setup_service.subprocess.Popen')
     @patch('backend.motor_setup_service.pty.openpty')
     @patch('backend.motor_setup_service.threading.Thread')
-    async def test_start_motor_setup_different_robot_type(self, mock_thread, mock_openpty, mock_popen, motor_setup_service):
+    async def test_start_motor_setup_different_robot_type(self, mock_thread, mock_openpty, mock_popen, mock_close, mock_set_blocking, motor_setup_service):
         """Test motor setup start with different robot type"""
         # Setup mocks
         mock_openpty.return_value = (10, 11)
@@ -83,11 +114,12 @@ class TestMotorSetupServiceStartMotorSetup:
         assert session_id in motor_setup_service.active_sessions
     
     @pytest.mark.asyncio
+    @patch('backend.motor_setup_service.time.time', return_value=1700000000)
     @patch('backend.motor_setup_service.subprocess.Popen')
-    async def test_start_motor_setup_existing_session_cleanup(self, mock_popen, motor_setup_service):
+    async def test_start_motor_setup_existing_session_cleanup(self, mock_popen, mock_time, motor_setup_service):
         """Test that existing sessions are cleaned up before starting new ones"""
         # Setup existing session
-        session_id = 'so100_motor_setup'
+        session_id = 'so100__dev_ttyUSB0_1700000000_motor_setup'
         motor_setup_service.active_processes[session_id] = (Mock(), 10)
         motor_setup_service.active_sessions[session_id] = {'status': 'running'}
         
@@ -204,23 +236,46 @@ class TestMotorSetupServiceOutputMethods:
     async def test_get_output_success(self, motor_setup_service):
         """Test getting output from session"""
         session_id = 'test_session'
-        mock_queue = Mock()
-        mock_queue.get_nowait.return_value = "Test output"
-        motor_setup_service.output_queues[session_id] = mock_queue
+        motor_setup_service._output_cursors[session_id] = 0
+        motor_setup_service._shared_output.append((1, session_id, "Test output"))
         
-        result = await motor_setup_service.get_output(session_id)
-        assert result == "Test output"
+        result = await motor_setup_service.get_all_output(session_id)
+        assert result == ["Test output"]
     
     @pytest.mark.asyncio
     async def test_get_output_no_output(self, motor_setup_service):
         """Test getting output when none available"""
         session_id = 'test_session'
-        mock_queue = Mock()
-        mock_queue.get_nowait.side_effect = Exception("Queue empty")
-        motor_setup_service.output_queues[session_id] = mock_queue
+        motor_setup_service._output_cursors[session_id] = 0
         
-        result = await motor_setup_service.get_output(session_id)
-        assert result is None
+        result = await motor_setup_service.get_all_output(session_id)
+        assert result == []
+    
+    @pytest.mark.asyncio
+    async def test_get_output_shared_buffer(self, motor_setup_service):
+        """Test that sessions only see their own output and each line is returned once"""
+        motor_setup_service._output_cursors['session1'] = 0
+        motor_setup_service._output_cursors['session2'] = 0
+        motor_setup_service._add_output('session1', 'a1')
+        motor_setup_service._add_output('session2', 'b1')
+        motor_setup_service._add_output('session1', 'a2')
+        
+        assert await motor_setup_service.get_all_output('session1') == ['a1', 'a2']
+        assert await motor_setup_service.get_all_output('session1') == []
+        assert await motor_setup_service.get_all_output('session2') == ['b1']
+    
+    @pytest.mark.asyncio
+    async def test_get_output_reports_evicted_output(self, motor_setup_service):
+        """Test that output evicted before it was read is reported to its session"""
+        motor_setup_service._shared_output = deque(maxlen=2)
+        motor_setup_service._output_cursors['session1'] = 0
+        motor_setup_service._output_cursors['session2'] = 0
+        motor_setup_service._add_output('session1', 'a1')
+        motor_setup_service._add_output('session2', 'b1')
+        motor_setup_service._add_output('session2', 'b2')
+        
+        assert await motor_setup_service.get_all_output('session1') == ['[1 earlier output chunks were dropped]\n']
+        assert await motor_setup_service.get_all_output('session2') == ['b1', 'b2']
     
     @pytest.mark.asyncio
     async def test_get_all_output_success(self, motor_setup_service):
@@ -257,7 +312,7 @@ class TestMotorSetupServiceStopMethods:
             assert result is True
             assert session_id not in motor_setup_service.active_processes
             assert session_id not in motor_setup_service.active_sessions
-            assert session_id not in motor_setup_service.output_queues
+            assert session_id not in motor_setup_service._output_cursors
             assert session_id in motor_setup_service.cancelled_sessions
             mock_killpg.assert_called_once_with(12345, 15)  # SIGTERM
     
@@ -296,9 +351,9 @@ class TestMotorSetupServiceInternalMethods:
         # Should not raise exception
         motor_setup_service._add_output('non_existent', 'Test message')
     
-    @patch('backend.motor_setup_service.select.select')
-    @patch('backend.motor_setup_service.os.read')
-    def test_monitor_motor_setup_subprocess(self, mock_read, mock_select, motor_setup_service):
+    @patch('backend.motor_setup_service.selectors.DefaultSelector')
+    @patch('backend.motor_setup_service.os.readv')
+    def test_monitor_motor_setup_subprocess(self, mock_read, mock_selector_cls, motor_setup_service):
         """Test the monitoring subprocess method"""
         # Setup mocks
         session_id = 'test_session'
@@ -309,9 +364,11 @@ class TestMotorSetupServiceInternalMethods:
         motor_setup_service.active_processes[session_id] = (mock_process, mock_master_fd)
         motor_setup_service.active_sessions[session_id] = {'status': 'starting'}
         
-        # Mock select to return ready fd
-        mock_select.return_value = ([mock_master_fd], [], [])
-        mock_read.return_value = b'Test output\n'
+        # Mock the selector to report the fd as ready
+        mock_select = mock_selector_cls.return_value.__enter__.return_value.select
+        mock_select.return_value = [(Mock(fd=mock_master_fd), 1)]
+        # One chunk, then the non-blocking PTY is drained
+        mock_read.side_effect = [len(b'Test output\n'), BlockingIOError, BlockingIOError, BlockingIOError]
         
         # Mock process to finish after one iteration
         mock_process.poll.side_effect = [None, 0]  # First call returns None, second returns 0
@@ -406,8 +463,11 @@ class TestMotorSetupServiceSessionManagement:
         """Test that session IDs are generated correctly"""
         session_id = motor_setup_service._generate_session_id('so100', '/dev/ttyUSB0')
         assert 'so100' in session_id
-        assert 'motor_setup' in session_id
+        assert '_dev_ttyUSB0' in session_id
         assert session_id.endswith('motor_setup')
+        
+        # The same robot type on another port must not collide with a running setup
+        assert motor_setup_service._generate_session_id('so100', '/dev/ttyUSB1') != session_id
     
     def test_session_cleanup(self, motor_setup_service):
         """Test session cleanup functionality"""
@@ -415,7 +475,7 @@ class TestMotorSetupServiceSessionManagement:
         
         # Add session data
         motor_setup_service.active_sessions[session_id] = {'status': 'running'}
-        motor_setup_service.output_queues[session_id] = Mock()
+        motor_setup_service._output_cursors[session_id] = 0
         motor_setup_service.active_processes[session_id] = (Mock(), 10)
         
         # Clean up
@@ -423,9 +483,21 @@ class TestMotorSetupServiceSessionManagement:
         
         # Verify cleanup
         assert session_id not in motor_setup_service.active_sessions
-        assert session_id not in motor_setup_service.output_queues
+        assert session_id not in motor_setup_service._output_cursors
         assert session_id not in motor_setup_service.active_processes
     
+    def test_session_cleanup_frees_shared_output(self, motor_setup_service):
+        """Test that a stopped session's unread output leaves the shared buffer"""
+        motor_setup_service._output_cursors['session1'] = 0
+        motor_setup_service._output_cursors['session2'] = 0
+        motor_setup_service._add_output('session1', 'a1')
+        motor_setup_service._add_output('session2', 'b1')
+        
+        motor_setup_service._cleanup_session('session1')
+        
+        assert [sid for _, sid, _ in motor_setup_service._shared_output] == ['session2']
+        assert motor_setup_service._shared_output.maxlen == 100_000
+    
     def test_multiple_sessions(self, motor_setup_service):
         """Test handling multiple concurrent sessions"""
         session1 = 'session1'
@@ -489,3 +561,25 @@ class TestMotorSetupServiceInternalMethods:
         motor_setup_service._add_output(session_id, 'Test message')
         
         assert 'Test message' in motor_setup_service.active_sessions[session_id]['output']
+
+class TestMotorSetupServiceRealPty:
+    """Drive the monitor loop against a real PTY to catch throughput regressions"""
+    
+    @pytest.mark.asyncio
+    async def test_drain_pty_throughput(self, real_pty_service, record_property):
+        """Test that every line printed by the child reaches get_all_output"""
+        start = time.perf_counter()
+        session_id = await real_pty_service.start_motor_setup('so100', '/dev/ttyUSB0')
+        outputs = []
+        while await real_pty_service.is_running(session_id):
+            outputs.extend(await real_pty_service.get_all_output(session_id))
+            assert time.perf_counter() - start < 30, "PTY drain is far too slow"
+            await asyncio.sleep(0.01)
+        outputs.extend(await real_pty_service.get_all_output(session_id))
+        elapsed = time.perf_counter() - start
+        
+        assert outputs[-1] == "Motor setup completed successfully!"
+        # First entry is the start banner, last is the completion message
+        lines = ''.join(outputs[1:-1]).split()
+        assert lines == [str(i) for i in range(REAL_PTY_LINES)]
+        record_property("lines_per_sec", round(REAL_PTY_LINES / elapsed))
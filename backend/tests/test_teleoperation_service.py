@@ -1,5 +1,10 @@
 import pytest
 import asyncio
+import os
+import pty
+import queue
+import subprocess
+import sys
 from unittest.mock import Mock, patch, AsyncMock, MagicMock
 from backend.teleoperation_service import TeleoperationService
 
@@ -7,12 +12,28 @@ from backend.teleoperation_service import TeleoperationService
 def teleop_service():
     return TeleoperationService()
 
+@pytest.fixture
+def pty_session(teleop_service, mock_process):
+    """Session wired to a real PTY pair, with the parsing state _watch_pty would create"""
+    session_id = 'leader_follower_teleop'
+    master_fd, slave_fd = pty.openpty()
+    os.set_blocking(master_fd, False)
+    teleop_service.output_queues[session_id] = queue.SimpleQueue()
+    teleop_service.active_sessions[session_id] = {'status': 'running', 'output': []}
+    teleop_service.active_processes[session_id] = (mock_process, master_fd)
+    teleop_service._pty_state[master_fd] = {
+        "process": mock_process, "partial": bytearray(), "table_buffer": [], "in_table": False
+    }
+    yield session_id, master_fd, slave_fd
+    os.close(master_fd)
+    os.close(slave_fd)
+
 @pytest.fixture
 def mock_process():
     """Create a mock subprocess process"""
-    process = Mock()
+    # spec= keeps the mock to Popen's real attributes instead of growing children on demand
+    process = MagicMock(spec=subprocess.Popen, pid=12345)
     process.poll.return_value = None  # Process is running
-    process.pid = 12345
     return process
 
 class TestTeleoperationServiceInitialization:
@@ -29,17 +50,16 @@ class TestTeleoperationServiceStartTeleoperation:
     """Test starting teleoperation processes"""
     
     @pytest.mark.asyncio
+    @patch('backend.teleoperation_service.os.close')
     @patch('backend.teleoperation_service.subprocess.Popen')
     @patch('backend.teleoperation_service.pty.openpty')
-    @patch('backend.teleoperation_service.threading.Thread')
-    async def test_start_teleoperation_success(self, mock_thread, mock_openpty, mock_popen, teleop_service):
+    @patch('backend.teleoperation_service.TeleoperationService._watch_pty')
+    async def test_start_teleoperation_success(self, mock_watch_pty, mock_openpty, mock_popen, mock_close, teleop_service):
         """Test successful teleoperation start"""
         # Setup mocks
         mock_openpty.return_value = (10, 11)  # master_fd, slave_fd
         mock_process = Mock()
         mock_popen.return_value = mock_process
-        mock_thread_instance = Mock()
-        mock_thread.return_value = mock_thread_instance
         
         # Test
         session_id = await teleop_service.start_teleoperation(
@@ -61,21 +81,19 @@ class TestTeleoperationServiceStartTeleoperation:
         assert session_id in teleop_service.output_queues
         assert session_id in teleop_service.active_processes
         assert mock_popen.called
-        assert mock_thread.called
-        assert mock_thread_instance.start.called
+        mock_watch_pty.assert_called_once_with(session_id, mock_process, 10)
     
     @pytest.mark.asyncio
+    @patch('backend.teleoperation_service.os.close')
     @patch('backend.teleoperation_service.subprocess.Popen')
     @patch('backend.teleoperation_service.pty.openpty')
-    @patch('backend.teleoperation_service.threading.Thread')
-    async def test_start_teleoperation_with_cameras(self, mock_thread, mock_openpty, mock_popen, teleop_service):
+    @patch('backend.teleoperation_service.TeleoperationService._watch_pty')
+    async def test_start_teleoperation_with_cameras(self, mock_watch_pty, mock_openpty, mock_popen, mock_close, teleop_service):
         """Test teleoperation start with camera configuration"""
         # Setup mocks
         mock_openpty.return_value = (10, 11)
         mock_process = Mock()
         mock_popen.return_value = mock_process
-        mock_thread_instance = Mock()
-        mock_thread.return_value = mock_thread_instance
         
         cameras = [
             {
@@ -107,11 +125,12 @@ class TestTeleoperationServiceStartTeleoperation:
     
     @pytest.mark.asyncio
     @patch('backend.teleoperation_service.subprocess.Popen')
-    async def test_start_teleoperation_existing_session_cleanup(self, mock_popen, teleop_service):
+    @patch('backend.teleoperation_service.TeleoperationService._watch_pty')
+    async def test_start_teleoperation_existing_session_cleanup(self, mock_watch_pty, mock_popen, teleop_service, mock_process):
         """Test that existing sessions are cleaned up before starting new ones"""
         # Setup existing session
         session_id = 'leader_robot_follower_robot_teleop'
-        teleop_service.active_processes[session_id] = (Mock(), 10)
+        teleop_service.active_processes[session_id] = (mock_process, 10)
         teleop_service.active_sessions[session_id] = {'status': 'running'}
         
         # Mock the cleanup
@@ -155,11 +174,9 @@ class TestTeleoperationServiceStatusMethods:
     """Test status checking methods"""
     
     @pytest.mark.asyncio
-    async def test_is_running_true(self, teleop_service):
+    async def test_is_running_true(self, teleop_service, mock_process):
         """Test is_running returns True for active session"""
         session_id = 'test_session'
-        mock_process = Mock()
-        mock_process.poll.return_value = None  # Process is running
         teleop_service.active_processes[session_id] = (mock_process, 10)
         
         result = await teleop_service.is_running(session_id)
@@ -172,10 +189,9 @@ class TestTeleoperationServiceStatusMethods:
         assert result is False
     
     @pytest.mark.asyncio
-    async def test_is_running_process_finished(self, teleop_service):
+    async def test_is_running_process_finished(self, teleop_service, mock_process):
         """Test is_running returns False for finished process"""
         session_id = 'test_session'
-        mock_process = Mock()
         mock_process.poll.return_value = 0  # Process finished
         teleop_service.active_processes[session_id] = (mock_process, 10)
         
@@ -198,23 +214,20 @@ class TestTeleoperationServiceOutputMethods:
     async def test_get_output_success(self, teleop_service):
         """Test getting output from session"""
         session_id = 'test_session'
-        mock_queue = Mock()
-        mock_queue.get_nowait.return_value = "Test output"
-        teleop_service.output_queues[session_id] = mock_queue
+        teleop_service.output_queues[session_id] = queue.SimpleQueue()
+        teleop_service.output_queues[session_id].put({"timestamp": "now", "message": "Test output"})
         
-        result = await teleop_service.get_output(session_id)
-        assert result == "Test output"
+        result = await teleop_service.get_all_output(session_id)
+        assert result == ["Test output"]
     
     @pytest.mark.asyncio
     async def test_get_output_no_output(self, teleop_service):
         """Test getting output when none available"""
         session_id = 'test_session'
-        mock_queue = Mock()
-        mock_queue.get_nowait.side_effect = Exception("Queue empty")
-        teleop_service.output_queues[session_id] = mock_queue
+        teleop_service.output_queues[session_id] = queue.SimpleQueue()
         
-        result = await teleop_service.get_output(session_id)
-        assert result is None
+        result = await teleop_service.get_all_output(session_id)
+        assert result == []
     
     @pytest.mark.asyncio
     async def test_get_all_output_success(self, teleop_service):
@@ -237,11 +250,9 @@ class TestTeleoperationServiceStopMethods:
     """Test stopping teleoperation processes"""
     
     @pytest.mark.asyncio
-    async def test_stop_teleoperation_success(self, teleop_service):
+    async def test_stop_teleoperation_success(self, teleop_service, mock_process):
         """Test successful teleoperation stop"""
         session_id = 'test_session'
-        mock_process = Mock()
-        mock_process.pid = 12345
         teleop_service.active_processes[session_id] = (mock_process, 10)
         teleop_service.active_sessions[session_id] = {'status': 'running'}
         
@@ -262,11 +273,9 @@ class TestTeleoperationServiceStopMethods:
         assert result is False
     
     @pytest.mark.asyncio
-    async def test_stop_teleoperation_exception_handling(self, teleop_service):
+    async def test_stop_teleoperation_exception_handling(self, teleop_service, mock_process):
         """Test exception handling during stop"""
         session_id = 'test_session'
-        mock_process = Mock()
-        mock_process.pid = 12345
         teleop_service.active_processes[session_id] = (mock_process, 10)
         
         with patch('os.killpg', side_effect=Exception("Kill failed")):
@@ -352,6 +361,37 @@ class TestTeleoperationServiceCommandBuilding:
         # Check that camera configuration is included
         camera_args = [arg for arg in command if 'camera' in arg.lower()]
         assert len(camera_args) > 0
+    
+    def test_build_teleoperation_command_ignores_extra_camera_fields(self, teleop_service):
+        """Test camera fields the command doesn't use, even unhashable ones, are ignored"""
+        camera = {"name": "front_camera", "index": 2, "fps": 15}
+        
+        command = teleop_service._build_teleoperation_command(
+            'so100_leader', '/dev/ttyUSB0', 'leader_robot',
+            'so100_follower', '/dev/ttyUSB1', 'follower_robot',
+            cameras=[camera]
+        )
+        with_extras = teleop_service._build_teleoperation_command(
+            'so100_leader', '/dev/ttyUSB0', 'leader_robot',
+            'so100_follower', '/dev/ttyUSB1', 'follower_robot',
+            cameras=[dict(camera, resolutions=[[640, 480]], settings={"exposure": 10})]
+        )
+        
+        assert with_extras == command
+    
+    def test_build_teleoperation_command_keeps_value_types(self, teleop_service):
+        """Test equal values of different types don't share a cached command"""
+        commands = [
+            teleop_service._build_teleoperation_command(
+                'so100_leader', '/dev/ttyUSB0', 'leader_robot',
+                'so100_follower', '/dev/ttyUSB1', 'follower_robot',
+                cameras=[{"name": "front_camera", "fps": fps}]
+            )
+            for fps in (30, 30.0)
+        ]
+        
+        assert '"fps": 30}' in commands[0][-2]
+        assert '"fps": 30.0}' in commands[1][-2]
 
 class TestTeleoperationServiceErrorScenarios:
     """Test various error scenarios"""
@@ -390,8 +430,8 @@ class TestTeleoperationServiceErrorScenarios:
         session_id = 'test_session'
         teleop_service.cancelled_sessions.add(session_id)
         
-        result = await teleop_service.get_output(session_id)
-        assert result is None
+        result = await teleop_service.get_all_output(session_id)
+        assert result == []
     
     @pytest.mark.asyncio
     async def test_get_all_output_session_cancelled(self, teleop_service):
@@ -422,3 +462,111 @@ class TestTeleoperationServiceBasicMethods:
         """Test stop_teleoperation returns False for non-existent session"""
         result = await teleop_service.stop_teleoperation('non_existent')
         assert result is False
+
+class TestTeleoperationServicePtyOutput:
+    """Test PTY output parsing and exit reporting"""
+    
+    @pytest.mark.asyncio
+    async def test_line_split_across_reads(self, teleop_service, pty_session):
+        """Test a line written in two pieces is emitted once, whole"""
+        session_id, master_fd, slave_fd = pty_session
+        
+        os.write(slave_fd, b'Connecting to fol')
+        teleop_service._on_pty_readable(session_id, master_fd)
+        assert await teleop_service.get_all_output(session_id) == []
+        
+        os.write(slave_fd, b'lower arm\n')
+        teleop_service._on_pty_readable(session_id, master_fd)
+        assert await teleop_service.get_all_output(session_id) == ['Connecting to follower arm']
+    
+    @pytest.mark.asyncio
+    async def test_carriage_return_ends_line(self, teleop_service, pty_session):
+        """Test progress output redrawn with \\r is emitted without waiting for a newline"""
+        session_id, master_fd, slave_fd = pty_session
+        
+        os.write(slave_fd, b'Recording 50%\r')
+        teleop_service._on_pty_readable(session_id, master_fd)
+        assert await teleop_service.get_all_output(session_id) == ['Recording 50%']
+    
+    @pytest.mark.asyncio
+    async def test_carriage_return_redraws_are_separate_lines(self, teleop_service, pty_session):
+        """Test several \\r redraws in one read come out as one line each"""
+        session_id, master_fd, slave_fd = pty_session
+        
+        os.write(slave_fd, b'P 10%\rP 20%\rP 30%\r')
+        teleop_service._on_pty_readable(session_id, master_fd)
+        assert await teleop_service.get_all_output(session_id) == ['P 10%', 'P 20%', 'P 30%']
+    
+    @pytest.mark.asyncio
+    async def test_unterminated_output_is_capped(self, teleop_service, pty_session):
+        """Test output without any line end is flushed once it reaches the cap"""
+        session_id, master_fd, slave_fd = pty_session
+        
+        with patch('backend.teleoperation_service._MAX_PARTIAL_LINE', 8):
+            os.write(slave_fd, b'abcd')
+            teleop_service._on_pty_readable(session_id, master_fd)
+            assert await teleop_service.get_all_output(session_id) == []
+            
+            os.write(slave_fd, b'efghij')
+            teleop_service._on_pty_readable(session_id, master_fd)
+        assert await teleop_service.get_all_output(session_id) == ['abcdefghij']
+        assert teleop_service._pty_state[master_fd]['partial'] == bytearray()
+    
+    @pytest.mark.asyncio
+    async def test_table_assembled_across_reads(self, teleop_service, pty_session):
+        """Test table lines are collected into one table output rather than queued line by line"""
+        session_id, master_fd, slave_fd = pty_session
+        
+        os.write(slave_fd, b'---------------------------\nNAME | NORM\n')
+        teleop_service._on_pty_readable(session_id, master_fd)
+        os.write(slave_fd, b'shoulder_pan.pos | 12.5\ntime: 16.67ms (60 Hz)\n')
+        teleop_service._on_pty_readable(session_id, master_fd)
+        
+        table = '---------------------------\nNAME | NORM\nshoulder_pan.pos | 12.5\ntime: 16.67ms (60 Hz)'
+        assert await teleop_service.get_latest_table(session_id) == table
+        assert await teleop_service.get_all_output(session_id) == []
+    
+    @pytest.mark.asyncio
+    async def test_exit_status_reported(self, teleop_service):
+        """Test a failing process reports its output and exit code"""
+        command = [sys.executable, '-c', 'print("hello"); raise SystemExit(3)']
+        with patch.object(teleop_service, '_build_teleoperation_command', return_value=command):
+            session_id = await teleop_service.start_teleoperation(
+                'so100_leader', '/dev/ttyUSB0', 'leader', 'so100_follower', '/dev/ttyUSB1', 'follower'
+            )
+        await asyncio.wait_for(asyncio.gather(*teleop_service._exit_watchers.values()), 10)
+        
+        outputs = await teleop_service.get_all_output(session_id)
+        assert 'hello' in outputs
+        assert outputs[-1] == 'Teleoperation failed with exit code 3'
+        assert teleop_service.active_sessions[session_id]['status'] == 'failed'
+        assert teleop_service._pty_state == {}
+    
+    @pytest.mark.asyncio
+    async def test_restart_keeps_new_session(self, teleop_service):
+        """Test the previous process's exit watcher leaves a restarted session alone"""
+        command = [sys.executable, '-c', 'import time; print("up", flush=True); time.sleep(30)']
+        with patch.object(teleop_service, '_build_teleoperation_command', return_value=command):
+            session_id = await teleop_service.start_teleoperation(
+                'so100_leader', '/dev/ttyUSB0', 'leader', 'so100_follower', '/dev/ttyUSB1', 'follower'
+            )
+            old_watchers = list(teleop_service._exit_watchers.values())
+            await teleop_service.start_teleoperation(
+                'so100_leader', '/dev/ttyUSB0', 'leader', 'so100_follower', '/dev/ttyUSB1', 'follower'
+            )
+        await asyncio.wait_for(asyncio.gather(*old_watchers), 10)
+        
+        process, master_fd = teleop_service.active_processes[session_id]
+        try:
+            assert teleop_service.active_sessions[session_id]['status'] == 'running'
+            assert master_fd in teleop_service._pty_state
+            for _ in range(100):
+                outputs = await teleop_service.get_all_output(session_id)
+                if 'up' in outputs:
+                    break
+                await asyncio.sleep(0.05)
+            assert 'up' in outputs
+            assert not any('exit code' in output for output in outputs)
+        finally:
+            await teleop_service.stop_teleoperation(session_id)
+            await asyncio.wait_for(asyncio.gather(*teleop_service._exit_watchers.values()), 10)
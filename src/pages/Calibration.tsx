@@ -267,8 +267,7 @@ export default function Calibration() {
       clearTimeout(connectionTimeout) // Clear timeout when connection is successful
     }
 
-    ws.onmessage = (event) => {
-      const data = JSON.parse(event.data)
+    const handleMessage = (data: any) => {
       console.log('WebSocket message received:', data)
       
       if (data.type === 'output') {
@@ -404,6 +403,16 @@ export default function Calibration() {
       }
     }
 
+    ws.onmessage = (event) => {
+      const message = JSON.parse(event.data)
+      // Bursts of output arrive as one output_batch frame; handle each line as an output message
+      if (message.type === 'output_batch') {
+        message.data.forEach((line: string) => handleMessage({ type: 'output', data: line }))
+      } else {
+        handleMessage(message)
+      }
+    }
+
     ws.onerror = (error) => {
       console.error('WebSocket error:', error)
       clearTimeout(connectionTimeout)